@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from usage_store import LATE_ARRIVAL_OVERLAP
+
+ANOMALY_ALPHA = float(os.getenv("CORTEX_COST_ANOMALY_ALPHA", "0.3"))
+ANOMALY_THRESHOLD = float(os.getenv("CORTEX_COST_ANOMALY_Z", "3"))
+ANOMALY_MIN_PERIODS = int(os.getenv("CORTEX_COST_ANOMALY_MIN_PERIODS", "5"))
+ANOMALY_MIN_CREDITS = float(os.getenv("CORTEX_COST_ANOMALY_MIN_CREDITS", "0.01"))
+ANOMALY_MIN_RATIO = float(os.getenv("CORTEX_COST_ANOMALY_MIN_RATIO", "0.5"))
+
+BUCKET_FREQUENCIES = {'HOUR': 'h', 'DAY': 'D', 'WEEK': 'W-MON', 'MONTH': 'MS'}
+
+FLAG_COLUMNS = ['DATE', 'DIMENSION', 'SERIES', 'CREDITS', 'BASELINE', 'ZSCORE']
+
+
+def credit_series(frames, granularity):
+    wide = []
+    for dimension, (df, column) in frames.items():
+        if df.empty:
+            continue
+        pivot = df.pivot_table(index='DATE', columns=column, values='CREDITS', aggfunc='sum', observed=True)
+        pivot.columns = pd.MultiIndex.from_arrays(
+            [[dimension] * len(pivot.columns), pivot.columns.astype(str)], names=['DIMENSION', 'SERIES']
+        )
+        wide.append(pivot)
+    if not wide:
+        return pd.DataFrame()
+    wide = pd.concat(wide, axis=1).sort_index()
+    # Buckets with no usage are zero spend, not missing observations.
+    buckets = pd.date_range(wide.index.min(), wide.index.max(), freq=BUCKET_FREQUENCIES[granularity])
+    return wide.reindex(wide.index.union(buckets)).fillna(0.0)
+
+
+class AnomalyState:
+    def __init__(self):
+        self.columns = pd.MultiIndex.from_arrays([[], []], names=['DIMENSION', 'SERIES'])
+        self.mean = np.zeros(0)
+        self.var = np.zeros(0)
+        self.count = np.zeros(0, dtype=int)
+        self.start = None
+        self.checkpoint = None
+        self.flags = pd.DataFrame(columns=FLAG_COLUMNS)
+
+    def covers(self, wide):
+        # A window that starts before the scored history needs those buckets scored too.
+        if self.checkpoint is None:
+            return True
+        return self.start <= wide.index.min() <= self.checkpoint <= wide.index.max()
+
+    def extend(self, columns):
+        new_columns = columns.difference(self.columns)
+        if len(new_columns):
+            self.columns = self.columns.append(new_columns)
+            self.mean = np.append(self.mean, np.zeros(len(new_columns)))
+            self.var = np.append(self.var, np.zeros(len(new_columns)))
+            self.count = np.append(self.count, np.zeros(len(new_columns), dtype=int))
+
+
+def detect_anomalies(
+    wide, state=None, settled_before=None, alpha=ANOMALY_ALPHA, threshold=ANOMALY_THRESHOLD,
+    min_periods=ANOMALY_MIN_PERIODS, min_credits=ANOMALY_MIN_CREDITS, min_ratio=ANOMALY_MIN_RATIO
+):
+    if wide.empty:
+        return state or AnomalyState(), pd.DataFrame(columns=FLAG_COLUMNS)
+    if state is None or not state.covers(wide):
+        state = AnomalyState()
+    state.extend(wide.columns)
+    if state.start is None:
+        state.start = wide.index.min()
+
+    pending = wide if state.checkpoint is None else wide[wide.index > state.checkpoint]
+    values = pending.reindex(columns=state.columns, fill_value=0.0).to_numpy(dtype='float64')
+    mean, var, count = state.mean.copy(), state.var.copy(), state.count.copy()
+    settled_flags, recent_flags = [], []
+
+    # One pass per bucket, vectorized across every series; the EWMA mean and
+    # variance carried in the state make each new bucket O(series).
+    for position, bucket in enumerate(pending.index):
+        x = values[position]
+        deviation = x - mean
+        std = np.sqrt(var)
+        zscore = np.divide(deviation, std, out=np.full_like(x, np.inf), where=std > 0)
+        # A very steady series has a tiny variance, so small wobbles also need to clear
+        # an absolute and a relative floor before they count as a spike.
+        floor = np.maximum(min_credits, min_ratio * mean)
+        flagged = (count >= min_periods) & (deviation >= floor) & (zscore >= threshold)
+        if flagged.any():
+            rows = pd.DataFrame({
+                'DATE': bucket,
+                'DIMENSION': state.columns.get_level_values('DIMENSION')[flagged],
+                'SERIES': state.columns.get_level_values('SERIES')[flagged],
+                'CREDITS': x[flagged],
+                'BASELINE': mean[flagged],
+                'ZSCORE': zscore[flagged],
+            })
+            settled = settled_before is None or bucket < settled_before
+            (settled_flags if settled else recent_flags).append(rows)
+
+        # Series start at their first non-zero bucket so new spend is not a spike against zeros.
+        first = (count == 0) & (x > 0)
+        active = count > 0
+        increment = alpha * deviation
+        mean = np.where(first, x, np.where(active, mean + increment, mean))
+        var = np.where(active, (1 - alpha) * (var + deviation * increment), var)
+        count = count + (first | active)
+
+        if settled_before is None or bucket < settled_before:
+            state.mean, state.var, state.count, state.checkpoint = mean.copy(), var.copy(), count.copy(), bucket
+
+    state.flags = concat_flags([state.flags, *settled_flags])
+    flags = concat_flags([state.flags, *recent_flags])
+    return state, flags[flags['DATE'] >= wide.index.min()].reset_index(drop=True)
+
+
+def concat_flags(frames):
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=FLAG_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def settled_bucket(window_end, overlap=LATE_ARRIVAL_OVERLAP):
+    # Buckets this close to the window end can still change as late rows land.
+    return pd.Timestamp(window_end) - overlap
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cortex_usage import (  # noqa: E402
+    FILTER_COLUMNS, apply_function_filters, attach_warehouse_names, compact_frame, cortex_functions_query_rollup_query,
+    cortex_functions_query_usage_query, credits_by, daily_breakdown, query_frame, result_batches, snap_window,
+    stream_frame, token_efficiency, warehouse_dimension_query,
+)
+from fake_session import FakeSession, generate_usage_tables  # noqa: E402
+from replay_session import FixtureStore, ReplaySession, session_clock  # noqa: E402
+from sql_builder import run_sql  # noqa: E402
+
+DEFAULT_ROWS = [10_000, 1_000_000, 10_000_000]
+
+
+def measure(results, stage, func, *args, **kwargs):
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = func(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results[stage] = {'seconds': elapsed, 'peak_mb': peak / 1_000_000}
+    return value
+
+
+def chained_filters(df, **filters):
+    # Indexes the frame once per filter, as apply_function_filters did before it built one mask.
+    for name, values in filters.items():
+        if values:
+            df = df[df[FILTER_COLUMNS[name]].isin(values)]
+    return df
+
+
+def run_pipeline(rows, days, batch_rows, fixtures=None, latency_ms=0):
+    results = {}
+    tables = measure(results, 'generate', generate_usage_tables, rows, days=days)
+    session = FakeSession(tables, batch_rows=batch_rows)
+    if fixtures or latency_ms:
+        # Recorded results are served first; anything not recorded comes from the synthetic tables.
+        store = FixtureStore(fixtures) if fixtures else None
+        session = ReplaySession(store, latency_ms / 1000, fallback=session)
+    now = session_clock(session)
+    start_date, end_date = snap_window(now - timedelta(days=days), now)
+    warehouse_names = run_sql(session, warehouse_dimension_query()).to_pandas().set_index('WAREHOUSE_ID')['WAREHOUSE_NAME']
+
+    raw_query = cortex_functions_query_usage_query(start_date, end_date)
+    raw = measure(results, 'fetch_raw', query_frame, session, raw_query)
+    measure(results, 'attach_names', attach_warehouse_names, raw, warehouse_names)
+    del raw
+    # The same library code query_frame runs, timed on batches that are already fetched.
+    raw_batches = list(result_batches(session, raw_query))
+    measure(results, 'compact_frame', lambda batches: [compact_frame(batch) for batch in batches], raw_batches)
+    raw_batches = list(result_batches(session, raw_query))
+    measure(results, 'stream_frame', stream_frame, iter(raw_batches))
+    del raw_batches
+
+    # Charts and tiles work on the rollup, with DATE bucketed by DATE_TRUNC in SQL, as in the app.
+    rollup = measure(
+        results, 'fetch_rollup', query_frame, session, cortex_functions_query_rollup_query(start_date, end_date)
+    )
+    rollup = attach_warehouse_names(rollup, warehouse_names)
+    filters = {
+        'models': tuple(rollup['MODEL_NAME'].cat.categories[:3]),
+        'functions': tuple(rollup['FUNCTION_NAME'].cat.categories[:4]),
+        'warehouses': tuple(rollup['WAREHOUSE_NAME'].dropna().unique()[:5]),
+    }
+    # Same frame and filters for both, so the two stages compare only the filtering strategy.
+    measure(results, 'filter_chained', chained_filters, rollup, **filters)
+    filtered = measure(results, 'filter', apply_function_filters, rollup, **filters)
+    measure(results, 'daily_breakdown', lambda: [
+        daily_breakdown(filtered, 'WAREHOUSE_NAME'),
+        daily_breakdown(filtered, 'MODEL_NAME', 'TOKENS'),
+    ])
+    measure(results, 'model_efficiency', token_efficiency, filtered, 'MODEL_NAME')
+    measure(results, 'function_tokens', token_efficiency, filtered, 'FUNCTION_NAME')
+    measure(results, 'credits_by', credits_by, filtered, 'WAREHOUSE_NAME')
+    return results
+
+
+def print_results(rows, results):
+    print(f"\n{rows:,} rows")
+    print(f"  {'stage':<18}{'seconds':>10}{'peak MB':>12}")
+    for stage, stats in results.items():
+        print(f"  {stage:<18}{stats['seconds']:>10.3f}{stats['peak_mb']:>12.1f}")
+
+
+def regressions(results, baseline, tolerance):
+    failures = []
+    for rows, stages in results.items():
+        for stage, stats in stages.items():
+            expected = baseline.get(rows, {}).get(stage)
+            if expected and stats['seconds'] > expected['seconds'] * (1 + tolerance):
+                failures.append(f"{rows} rows / {stage}: {stats['seconds']:.3f}s vs baseline {expected['seconds']:.3f}s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Cortex Cost Monitor data pipeline on synthetic usage data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--batch-rows", type=int, default=100_000, help="rows per result batch from the fake session")
+    parser.add_argument("--fixtures", help="serve queries recorded with CORTEX_COST_SESSION_MODE=record from this directory")
+    parser.add_argument("--latency-ms", type=int, default=0, help="simulated latency added to every query")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown per stage, as a fraction")
+    args = parser.parse_args()
+
+    results = {}
+    for rows in args.rows:
+        results[str(rows)] = run_pipeline(rows, args.days, args.batch_rows, args.fixtures, args.latency_ms)
+        print_results(rows, results[str(rows)])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import json
+
+import altair as alt
+
+from cortex_usage import GRANULARITY_FORMATS
+
+EFFICIENCY_SCALE = alt.Scale(scheme='redyellowgreen', reverse=True)
+
+
+def chart_data(df, *columns):
+    # Only the encoded columns are serialized into the spec.
+    return df[list(dict.fromkeys(columns))]
+
+
+def time_area_chart(df, series, measure, series_title, measure_title, granularity, measure_format='.6f', height=400):
+    return alt.Chart(chart_data(df, 'DATE', series, measure)).mark_area().encode(
+        x=alt.X('DATE:T', title=f'Date ({granularity.lower()})'),
+        y=alt.Y(f'{measure}:Q', title=measure_title, stack='zero'),
+        color=alt.Color(f'{series}:N', title=series_title),
+        tooltip=[
+            alt.Tooltip('DATE:T', format=GRANULARITY_FORMATS[granularity], title='Date'),
+            f'{series}:N',
+            alt.Tooltip(f'{measure}:Q', format=measure_format)
+        ]
+    ).properties(height=height)
+
+
+def anomaly_rules(flags, series, series_title, granularity):
+    # Rules rather than points so markers do not depend on where a series sits in the stack.
+    data = flags.rename(columns={'SERIES': series})
+    return alt.Chart(chart_data(data, 'DATE', series, 'CREDITS', 'BASELINE', 'ZSCORE')).mark_rule(
+        color='red', strokeDash=[4, 2]
+    ).encode(
+        x='DATE:T',
+        tooltip=[
+            alt.Tooltip('DATE:T', format=GRANULARITY_FORMATS[granularity], title='Date'),
+            alt.Tooltip(f'{series}:N', title=series_title),
+            alt.Tooltip('CREDITS:Q', format='.6f'),
+            alt.Tooltip('BASELINE:Q', format='.6f'),
+            alt.Tooltip('ZSCORE:Q', format='.1f', title='Z-score')
+        ]
+    )
+
+
+def with_anomalies(chart, flags, series, series_title, granularity):
+    if flags.empty:
+        return chart
+    return alt.layer(chart, anomaly_rules(flags, series, series_title, granularity))
+
+
+def bar_chart(df, category, measure, category_title, measure_title, color=None, tooltip=(), height=300):
+    columns = [category, measure] + ([color.shorthand.split(':')[0]] if color is not None else [])
+    columns += [item.shorthand.split(':')[0] for item in tooltip]
+    encoding = {
+        'x': alt.X(f'{measure}:Q', title=measure_title),
+        'y': alt.Y(f'{category}:N', sort='-x', title=category_title),
+        'tooltip': [f'{category}:N', *tooltip] if tooltip else [f'{category}:N', f'{measure}:Q'],
+    }
+    if color is not None:
+        encoding['color'] = color
+    return alt.Chart(chart_data(df, *columns)).mark_bar().encode(**encoding).properties(height=height)
+
+
+def efficiency_color(title='Credits/1M Tokens', legend=True):
+    if legend:
+        return alt.Color('CREDITS_PER_1M_TOKENS:Q', scale=EFFICIENCY_SCALE, title=title)
+    return alt.Color('CREDITS_PER_1M_TOKENS:Q', scale=EFFICIENCY_SCALE, legend=None)
+
+
+def chart_rows(chart):
+    return sum(len(layer.data) for layer in getattr(chart, 'layer', None) or [chart])
+
+
+def spec_size(chart):
+    with alt.data_transformers.enable('default', max_rows=None):
+        return len(json.dumps(chart.to_dict(), default=str))
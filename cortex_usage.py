@@ -0,0 +1,748 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, union_categoricals
+
+from diagnostics import record, statement_params
+from sql_builder import Query, bind, in_list, join, run_sql, timestamp_bind
+from usage_store import to_wall_time
+
+WINDOW_GRANULARITY = os.getenv("CORTEX_COST_WINDOW_GRANULARITY", "h")
+
+def snap_window(start_date, end_date, granularity=WINDOW_GRANULARITY):
+    start = pd.Timestamp(start_date).floor(granularity)
+    end = pd.Timestamp(end_date).ceil(granularity)
+    return start.to_pydatetime(), end.to_pydatetime()
+
+def model_name_expr(alias):
+    return f"""CASE 
+            WHEN {alias}.MODEL_NAME IS NULL OR TRIM({alias}.MODEL_NAME) = '' THEN 'internal-models'
+            ELSE {alias}.MODEL_NAME 
+        END"""
+
+def window_predicate(start_column, end_column, start_date, end_date):
+    return f"{start_column} >= " + timestamp_bind(start_date) + f" AND {end_column} <= " + timestamp_bind(end_date)
+
+def function_filter_predicates(alias, warehouse_ids=None, models=None, functions=None):
+    predicates = []
+    if warehouse_ids:
+        predicates.append(in_list(f"{alias}.WAREHOUSE_ID", warehouse_ids))
+    if models:
+        predicates.append(in_list(model_name_expr(alias), models))
+    if functions:
+        predicates.append(in_list(f"{alias}.FUNCTION_NAME", functions))
+    return join(("\n    AND " + predicate for predicate in predicates), "")
+
+def cortex_analyst_usage_query(start_date, end_date):
+    return """
+    SELECT 
+        START_TIME,
+        END_TIME,
+        USERNAME,
+        CREDITS,
+        REQUEST_COUNT,
+        'Cortex Analyst' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_ANALYST_USAGE_HISTORY
+    WHERE """ + window_predicate('START_TIME', 'END_TIME', start_date, end_date) + """
+    ORDER BY START_TIME DESC
+    """
+
+def cortex_functions_usage_query(start_date, end_date, warehouse_ids=None, models=None, functions=None):
+    return f"""
+    SELECT 
+        f.START_TIME,
+        f.END_TIME,
+        f.FUNCTION_NAME,
+        {model_name_expr('f')} as MODEL_NAME,
+        f.WAREHOUSE_ID,
+        f.TOKEN_CREDITS as CREDITS,
+        f.TOKENS,
+        'Cortex Functions' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_USAGE_HISTORY f
+    WHERE """ + window_predicate('f.START_TIME', 'f.END_TIME', start_date, end_date) + function_filter_predicates(
+        'f', warehouse_ids, models, functions
+    ) + """
+    ORDER BY f.START_TIME DESC
+    """
+
+def cortex_search_usage_query(start_date, end_date):
+    return """
+    SELECT 
+        START_TIME,
+        END_TIME,
+        DATABASE_NAME,
+        SCHEMA_NAME,
+        SERVICE_NAME,
+        SERVICE_ID,
+        CREDITS,
+        'Cortex Search' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_SEARCH_SERVING_USAGE_HISTORY
+    WHERE """ + window_predicate('START_TIME', 'END_TIME', start_date, end_date) + """
+    ORDER BY START_TIME DESC
+    """
+
+def query_history_join(start_date, end_date, prune=True):
+    if not prune:
+        return Query("""LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY qh 
+        ON q.QUERY_ID = qh.QUERY_ID""")
+    # Restrict QUERY_HISTORY to the window before joining so only the
+    # micro-partitions for the selected dates are scanned.
+    return """JOIN (
+        SELECT QUERY_ID, START_TIME, END_TIME
+        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+        WHERE """ + window_predicate('START_TIME', 'START_TIME', start_date, end_date) + """
+            AND END_TIME <= """ + timestamp_bind(end_date) + """
+    ) qh ON q.QUERY_ID = qh.QUERY_ID"""
+
+def cortex_functions_query_usage_query(start_date, end_date, prune_query_history=True):
+    return f"""
+    SELECT 
+        q.QUERY_ID,
+        q.WAREHOUSE_ID,
+        {model_name_expr('q')} as MODEL_NAME,
+        q.FUNCTION_NAME,
+        q.TOKENS,
+        q.TOKEN_CREDITS as CREDITS,
+        qh.START_TIME,
+        qh.END_TIME,
+        'Cortex Functions Query' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY q
+    """ + query_history_join(start_date, end_date, prune_query_history) + """
+    WHERE """ + window_predicate('qh.START_TIME', 'qh.END_TIME', start_date, end_date) + """
+    ORDER BY qh.START_TIME DESC
+    """
+
+def period_column(time_column, start_date, compare_start):
+    # With a comparison window the scan covers both periods and every row is labelled with its period.
+    if compare_start is None:
+        return Query("")
+    return f"\n        IFF({time_column} >= " + timestamp_bind(start_date) + ", 'current', 'previous') as PERIOD,"
+
+def group_positions(count, compare_start):
+    return ", ".join(str(position) for position in range(1, count + 1 + (compare_start is not None)))
+
+def cortex_analyst_rollup_query(start_date, end_date, granularity='DAY', compare_start=None):
+    return f"""
+    SELECT 
+        DATE_TRUNC('{granularity}', START_TIME) as DATE,""" + period_column('START_TIME', start_date, compare_start) + """
+        SUM(CREDITS) as CREDITS,
+        SUM(REQUEST_COUNT) as REQUESTS,
+        'Cortex Analyst' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_ANALYST_USAGE_HISTORY
+    WHERE """ + window_predicate('START_TIME', 'END_TIME', compare_start or start_date, end_date) + f"""
+    GROUP BY {group_positions(1, compare_start)}
+    ORDER BY 1
+    """
+
+def cortex_functions_rollup_query(start_date, end_date, granularity='DAY', compare_start=None):
+    return f"""
+    SELECT 
+        DATE_TRUNC('{granularity}', f.START_TIME) as DATE,""" + period_column('f.START_TIME', start_date, compare_start) + f"""
+        f.FUNCTION_NAME,
+        {model_name_expr('f')} as MODEL_NAME,
+        f.WAREHOUSE_ID,
+        SUM(f.TOKEN_CREDITS) as CREDITS,
+        SUM(f.TOKENS) as TOKENS,
+        'Cortex Functions' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_USAGE_HISTORY f
+    WHERE """ + window_predicate('f.START_TIME', 'f.END_TIME', compare_start or start_date, end_date) + f"""
+    GROUP BY {group_positions(4, compare_start)}
+    ORDER BY 1
+    """
+
+def cortex_search_rollup_query(start_date, end_date, granularity='DAY', compare_start=None):
+    return f"""
+    SELECT 
+        DATE_TRUNC('{granularity}', START_TIME) as DATE,""" + period_column('START_TIME', start_date, compare_start) + """
+        SUM(CREDITS) as CREDITS,
+        'Cortex Search' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_SEARCH_SERVING_USAGE_HISTORY
+    WHERE """ + window_predicate('START_TIME', 'END_TIME', compare_start or start_date, end_date) + f"""
+    GROUP BY {group_positions(1, compare_start)}
+    ORDER BY 1
+    """
+
+def cortex_functions_query_rollup_query(start_date, end_date, prune_query_history=True, granularity='DAY', compare_start=None):
+    scan_start = compare_start or start_date
+    return f"""
+    SELECT 
+        DATE_TRUNC('{granularity}', qh.START_TIME) as DATE,""" + period_column('qh.START_TIME', start_date, compare_start) + f"""
+        q.FUNCTION_NAME,
+        {model_name_expr('q')} as MODEL_NAME,
+        q.WAREHOUSE_ID,
+        COUNT(*) as REQUESTS,
+        SUM(q.TOKENS) as TOKENS,
+        SUM(q.TOKEN_CREDITS) as CREDITS,
+        'Cortex Functions Query' as SERVICE_TYPE
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY q
+    """ + query_history_join(scan_start, end_date, prune_query_history) + """
+    WHERE """ + window_predicate('qh.START_TIME', 'qh.END_TIME', scan_start, end_date) + f"""
+    GROUP BY {group_positions(4, compare_start)}
+    ORDER BY 1
+    """
+
+USAGE_KEY_COLUMNS = {
+    'analyst': ['START_TIME', 'END_TIME', 'USERNAME'],
+    'functions': ['START_TIME', 'END_TIME', 'FUNCTION_NAME', 'MODEL_NAME', 'WAREHOUSE_ID'],
+    'search': ['START_TIME', 'END_TIME', 'SERVICE_ID'],
+    'functions_query': ['QUERY_ID', 'FUNCTION_NAME', 'MODEL_NAME'],
+}
+
+FILTER_COLUMNS = {
+    'warehouses': 'WAREHOUSE_NAME',
+    'warehouse_ids': 'WAREHOUSE_ID',
+    'models': 'MODEL_NAME',
+    'functions': 'FUNCTION_NAME',
+}
+
+FILTER_MASK_CACHE_SIZE = 32
+
+def filter_mask(df, **filters):
+    mask = np.ones(len(df), dtype=bool)
+    for name, values in filters.items():
+        if not values:
+            continue
+        column = df[FILTER_COLUMNS[name]]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Test each category once and look rows up by code; code -1 (NaN) hits the trailing False.
+            selected = np.append(column.cat.categories.isin(values), False)
+            mask &= selected[column.cat.codes.to_numpy()]
+        else:
+            mask &= column.isin(values).to_numpy()
+    return mask
+
+def filter_signature(df, filters):
+    return (
+        df.attrs.get('FRAME_ID'),
+        tuple(sorted((name, tuple(sorted(map(str, values)))) for name, values in filters.items() if values)),
+    )
+
+def apply_function_filters(df, mask_cache=None, **filters):
+    if df.empty or not any(filters.values()):
+        return df
+    signature = filter_signature(df, filters)
+    if mask_cache is None or signature[0] is None:
+        return df[filter_mask(df, **filters)]
+    mask = mask_cache.pop(signature, None)
+    if mask is None:
+        mask = filter_mask(df, **filters)
+    mask_cache[signature] = mask
+    while len(mask_cache) > FILTER_MASK_CACHE_SIZE:
+        mask_cache.pop(next(iter(mask_cache)))
+    return df[mask]
+
+DIMENSION_COLUMNS = [
+    'MODEL_NAME', 'FUNCTION_NAME', 'WAREHOUSE_ID', 'WAREHOUSE_NAME', 'USERNAME',
+    'DATABASE_NAME', 'SCHEMA_NAME', 'SERVICE_NAME', 'SERVICE_ID', 'PERIOD',
+]
+INTEGER_COLUMNS = ['TOKENS', 'REQUESTS', 'REQUEST_COUNT']
+FLOAT_COLUMNS = ['CREDITS']
+CONSTANT_COLUMNS = ['SERVICE_TYPE']
+
+def compact_frame(df):
+    if df.empty:
+        return df
+    for column in CONSTANT_COLUMNS:
+        if column in df.columns and df[column].nunique(dropna=False) == 1:
+            df.attrs[column] = df[column].iloc[0]
+            df = df.drop(columns=column)
+    if 'DATE' in df.columns:
+        df['DATE'] = to_wall_time(pd.to_datetime(df['DATE']))
+    for column in DIMENSION_COLUMNS:
+        if column in df.columns:
+            if is_numeric_dtype(df[column]):
+                # IDs arrive as int8..int64, or float64 when a batch has NULLs; one nullable
+                # type keeps the categories of every batch and account compatible.
+                df[column] = df[column].astype('Int64')
+            df[column] = df[column].astype('category')
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            # Signed, so differences between counts (period deltas) cannot wrap around.
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+    # Credits stay float64: float32 loses precision in sums of sub-micro-credit values.
+    for column in FLOAT_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column]).astype('float64')
+    return df
+
+def result_batches(session, query, stats=None):
+    job = run_sql(session, query).collect_nowait(statement_params=statement_params())
+    if stats is not None:
+        stats['QUERY_ID'] = job.query_id
+    return job.result("pandas_batches")
+
+def concat_frames(frames):
+    frames = list(frames)
+    non_empty = [df for df in frames if not df.empty]
+    if len(non_empty) <= 1:
+        return non_empty[0] if non_empty else (frames[0] if frames else pd.DataFrame())
+    columns = {}
+    for column in non_empty[0].columns:
+        parts = [df[column] for df in non_empty]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            if len({part.cat.categories.dtype for part in parts}) > 1:
+                # Frames compacted elsewhere (older cache entries) can still disagree on the category type.
+                parts = [part.astype(object) for part in parts]
+                columns[column] = pd.concat(parts, ignore_index=True).astype('category')
+            else:
+                columns[column] = union_categoricals(parts, ignore_order=True)
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    df = pd.DataFrame(columns)
+    df.attrs = dict(non_empty[0].attrs)
+    return df
+
+def stream_frame(batches, on_batch=None, stats=None):
+    frames = []
+    rows = 0
+    transferred = 0
+    post_seconds = 0.0
+    for batch in batches:
+        started = time.perf_counter()
+        transferred += int(batch.memory_usage(deep=True).sum())
+        frames.append(compact_frame(batch))
+        post_seconds += time.perf_counter() - started
+        rows += len(batch)
+        if on_batch is not None:
+            on_batch(rows)
+    started = time.perf_counter()
+    df = concat_frames(frames)
+    df.attrs['FRAME_ID'] = uuid.uuid4().hex
+    if stats is not None:
+        stats.update(ROWS=rows, BYTES=transferred, POST_SECONDS=post_seconds + time.perf_counter() - started)
+    return df
+
+def query_frame(session, query, on_batch=None, cache=None, role=None):
+    started = time.perf_counter()
+    if cache is not None:
+        df = cache.get(query, role)
+        if df is not None:
+            record('query', CACHE='result_cache', SECONDS=time.perf_counter() - started, ROWS=len(df))
+            return df
+    stats = {}
+    df = stream_frame(result_batches(session, query, stats), on_batch, stats)
+    # Stored as text so it survives the result cache's Parquet metadata; cache hits keep the original fetch time.
+    df.attrs['LOADED_AT'] = pd.Timestamp.now().isoformat()
+    if cache is not None:
+        cache.put(query, role, df)
+    record('query', CACHE='miss', SECONDS=time.perf_counter() - started, **stats)
+    return df
+
+def with_constant_columns(df):
+    return df.assign(**{column: df.attrs[column] for column in CONSTANT_COLUMNS if column in df.attrs})
+
+def frame_memory(frames):
+    return pd.DataFrame([
+        {'FRAME': name, 'ROWS': len(df), 'MEMORY_MB': df.memory_usage(deep=True).sum() / 1_000_000}
+        for name, df in frames.items()
+    ])
+
+def warehouse_dimension_query():
+    return Query("""
+    SELECT 
+        WAREHOUSE_ID,
+        WAREHOUSE_NAME
+    FROM SNOWFLAKE.ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY WAREHOUSE_ID ORDER BY START_TIME DESC) = 1
+    """)
+
+def attach_warehouse_names(df, warehouse_names):
+    if df.empty:
+        return df
+    warehouse_ids = df['WAREHOUSE_ID'].astype('category')
+    return df.assign(WAREHOUSE_ID=warehouse_ids, WAREHOUSE_NAME=warehouse_ids.map(warehouse_names))
+
+def warehouse_ids_for(warehouse_names, names):
+    if not names:
+        return None
+    return tuple(warehouse_names.index[warehouse_names.isin(names)])
+
+def refresh_store(session, store, view, build_query, start_date, end_date):
+    for fetch_start, fetch_end in store.missing_ranges(view, start_date, end_date):
+        batches = result_batches(session, build_query(fetch_start, fetch_end))
+        store.merge_batches(view, batches, USAGE_KEY_COLUMNS[view], fetch_start, fetch_end)
+
+def usage_batches(session, store, view, build_query, start_date, end_date, **filters):
+    if store is None:
+        return result_batches(session, build_query(start_date, end_date, **filters))
+    refresh_store(session, store, view, build_query, start_date, end_date)
+    return (apply_function_filters(df, **filters) for df in store.read_batches(view, start_date, end_date))
+
+USAGE_QUERIES = {
+    'analyst': cortex_analyst_usage_query,
+    'functions': cortex_functions_usage_query,
+    'search': cortex_search_usage_query,
+    'functions_query': cortex_functions_query_usage_query,
+}
+
+DETAIL_PAGE_SIZE = int(os.getenv("CORTEX_COST_DETAIL_PAGE_SIZE", "500"))
+
+DETAIL_COLUMNS = {
+    'analyst': (['START_TIME', 'END_TIME', 'USERNAME', 'CREDITS', 'REQUEST_COUNT'], ['USERNAME']),
+    'functions': (
+        ['START_TIME', 'END_TIME', 'FUNCTION_NAME', 'MODEL_NAME', 'WAREHOUSE_ID', 'CREDITS', 'TOKENS'],
+        ['FUNCTION_NAME', 'MODEL_NAME'],
+    ),
+    'search': (
+        ['START_TIME', 'END_TIME', 'DATABASE_NAME', 'SCHEMA_NAME', 'SERVICE_NAME', 'CREDITS'],
+        ['SERVICE_NAME', 'DATABASE_NAME', 'SCHEMA_NAME'],
+    ),
+}
+
+def unordered(query):
+    # The trailing ORDER BY never carries binds, so the parameters stay valid.
+    return Query(query.text.rstrip().rsplit("ORDER BY", 1)[0].rstrip(), query.params)
+
+def like_pattern(value):
+    # Search text is matched literally: LIKE wildcards typed into a filter are escaped.
+    for character in "!%_":
+        value = value.replace(character, f"!{character}")
+    return f"%{value}%"
+
+def detail_source(query, column_filters=()):
+    predicates = [bind(f"{column} ILIKE ? ESCAPE '!'", like_pattern(value)) for column, value in column_filters if value]
+    where = "\n    WHERE " + join(predicates, " AND ") if predicates else ""
+    return "FROM (" + unordered(query) + """
+    ) d""" + where
+
+def detail_count_query(query, column_filters=()):
+    return """
+    SELECT COUNT(*) as ROWS
+    """ + detail_source(query, column_filters) + """
+    """
+
+def detail_page_query(
+    query, sort_column, descending=True, page=0, page_size=DETAIL_PAGE_SIZE, column_filters=(), key_columns=()
+):
+    direction = "DESC" if descending else "ASC"
+    # The row key breaks ties, so LIMIT/OFFSET pages neither repeat nor skip rows.
+    tie_breakers = [f"{column} DESC" for column in ['START_TIME', *key_columns] if column != sort_column]
+    order = ", ".join([f"{sort_column} {direction}", *dict.fromkeys(tie_breakers)])
+    return """
+    SELECT *
+    """ + detail_source(query, column_filters) + f"""
+    ORDER BY {order}
+    LIMIT {int(page_size)} OFFSET {int(page) * int(page_size)}
+    """
+
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'text/csv'),
+    'csv.gz': ('CSV (gzip)', 'application/gzip'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+}
+
+EXPORT_DIR = os.getenv("CORTEX_COST_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "cortex_cost_exports"))
+EXPORT_TTL_SECONDS = int(os.getenv("CORTEX_COST_EXPORT_TTL_SECONDS", "300"))
+EXPORT_STAGE = os.getenv("CORTEX_COST_EXPORT_STAGE")
+EXPORT_STAGE_ROWS = int(os.getenv("CORTEX_COST_EXPORT_STAGE_ROWS", "1000000"))
+
+def export_signature(view, start_date, end_date, export_format, filters):
+    key = (
+        view, str(start_date), str(end_date), export_format,
+        tuple(sorted((name, tuple(sorted(map(str, values)))) for name, values in filters.items() if values)),
+    )
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+def export_path(signature, export_format, export_dir=EXPORT_DIR):
+    return os.path.join(export_dir, f"{signature}.{export_format}")
+
+def export_is_fresh(path, ttl_seconds=EXPORT_TTL_SECONDS):
+    try:
+        return time.time() - os.path.getmtime(path) < ttl_seconds
+    except FileNotFoundError:
+        return False
+
+def prune_exports(export_dir=EXPORT_DIR, ttl_seconds=EXPORT_TTL_SECONDS):
+    if not os.path.isdir(export_dir):
+        return
+    for name in os.listdir(export_dir):
+        if '.tmp-' in name:
+            continue
+        path = os.path.join(export_dir, name)
+        if not export_is_fresh(path, ttl_seconds):
+            # Another session may be pruning the same directory.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def _write_csv(batches, path, compress):
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', newline='') as f:
+        header = True
+        for df in batches:
+            df.to_csv(f, index=False, header=header)
+            header = False
+
+def _write_parquet(batches, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for df in batches:
+            if writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pd.DataFrame().to_parquet(path)
+
+def write_export(batches, path, export_format):
+    prune_exports(os.path.dirname(path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Sessions are threads of one process, so the pid alone would let two viewers share a temp file.
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    if export_format == 'parquet':
+        _write_parquet(batches, tmp_path)
+    else:
+        _write_csv(batches, tmp_path, compress=export_format == 'csv.gz')
+    os.replace(tmp_path, path)
+    return path
+
+def stage_export_location(stage, signature):
+    return f"@{stage}/cortex_cost_exports/{signature}/"
+
+def stage_export_query(query, stage, signature, export_format):
+    file_format = {
+        'csv': "TYPE = CSV COMPRESSION = NONE FIELD_OPTIONALLY_ENCLOSED_BY = '\"'",
+        'csv.gz': "TYPE = CSV COMPRESSION = GZIP FIELD_OPTIONALLY_ENCLOSED_BY = '\"'",
+        'parquet': "TYPE = PARQUET",
+    }[export_format]
+    return f"""
+    COPY INTO {stage_export_location(stage, signature)}
+    FROM (""" + unordered(query) + f"""
+    )
+    FILE_FORMAT = ({file_format})
+    HEADER = TRUE
+    OVERWRITE = TRUE
+    """
+
+ROLLUP_TABLE = os.getenv("CORTEX_COST_ROLLUP_TABLE", "CORTEX_COST_DAILY")
+
+ROLLUP_TABLE_COLUMNS = {
+    'Cortex Analyst': ([], ['CREDITS', 'REQUESTS']),
+    'Cortex Functions': (['FUNCTION_NAME', 'MODEL_NAME', 'WAREHOUSE_ID'], ['CREDITS', 'TOKENS']),
+    'Cortex Search': ([], ['CREDITS']),
+    'Cortex Functions Query': (['FUNCTION_NAME', 'MODEL_NAME', 'WAREHOUSE_ID'], ['REQUESTS', 'TOKENS', 'CREDITS']),
+}
+
+def rollup_table_query(service_type, start_date, end_date, table=ROLLUP_TABLE, granularity='DAY', compare_start=None):
+    dimensions, measures = ROLLUP_TABLE_COLUMNS[service_type]
+    period = [] if compare_start is None else [
+        "IFF(DAY >= DATE_TRUNC('DAY', " + timestamp_bind(start_date) + "), 'current', 'previous') as PERIOD"
+    ]
+    columns = join(
+        [Query(f"DATE_TRUNC('{granularity}', DAY) as DATE")] + period + dimensions
+        + [f"SUM({measure}) as {measure}" for measure in measures],
+        ",\n        "
+    )
+    return """
+    SELECT 
+        """ + columns + f""",
+        '{service_type}' as SERVICE_TYPE
+    FROM {table}
+    WHERE SERVICE_TYPE = '{service_type}'
+        AND DAY >= DATE_TRUNC('DAY', """ + timestamp_bind(compare_start or start_date) + ") AND DAY < " + timestamp_bind(end_date) + f"""
+    GROUP BY {group_positions(len(dimensions) + 1, compare_start)}
+    ORDER BY 1
+    """
+
+ROLLUP_MAX_LAG = pd.Timedelta(hours=int(os.getenv("CORTEX_COST_ROLLUP_MAX_LAG_HOURS", "24")))
+
+def table_coverage(session, table):
+    # MIN/MAX on the clustering key is answered from metadata, so the probe stays cheap.
+    try:
+        row = session.sql(f"SELECT MIN(DAY) as FIRST_DAY, MAX(DAY) as LAST_DAY FROM {table}").collect()[0]
+    except Exception:
+        return None
+    if row['FIRST_DAY'] is None or row['LAST_DAY'] is None:
+        return None
+    return tuple(pd.Timestamp(row[column]).tz_localize(None) for column in ('FIRST_DAY', 'LAST_DAY'))
+
+def rollup_covers(coverage, start_date, end_date, max_lag=ROLLUP_MAX_LAG):
+    # An empty table, a refresh task that stopped, or a window older than the backfill
+    # would otherwise show as missing usage, so those windows read the raw views.
+    if coverage is None:
+        return False
+    first_day, last_day = coverage
+    return first_day <= pd.Timestamp(start_date).floor('D') and last_day >= pd.Timestamp(end_date) - max_lag
+
+def load_rollup(
+    session, service_type, build_query, start_date, end_date, rollup_coverage=None, cache=None, role=None,
+    granularity='DAY', compare_start=None
+):
+    # The rollup table is daily, so hourly buckets always come from the raw views.
+    if granularity != 'HOUR' and rollup_covers(rollup_coverage, compare_start or start_date, end_date):
+        query = rollup_table_query(service_type, start_date, end_date, granularity=granularity, compare_start=compare_start)
+    else:
+        query = build_query(start_date, end_date, granularity=granularity, compare_start=compare_start)
+    return query_frame(session, query, cache=cache, role=role)
+
+GRANULARITIES = ['HOUR', 'DAY', 'WEEK', 'MONTH']
+
+GRANULARITY_STEPS = {
+    'HOUR': pd.Timedelta(hours=1),
+    'DAY': pd.Timedelta(days=1),
+    'WEEK': pd.Timedelta(weeks=1),
+    'MONTH': pd.Timedelta(days=30),
+}
+
+GRANULARITY_FORMATS = {
+    'HOUR': '%Y-%m-%d %H:00',
+    'DAY': '%Y-%m-%d',
+    'WEEK': 'Week of %Y-%m-%d',
+    'MONTH': '%B %Y',
+}
+
+CHART_POINT_BUDGET = int(os.getenv("CORTEX_COST_CHART_POINTS", "200"))
+CHART_SERIES_LIMIT = int(os.getenv("CORTEX_COST_CHART_SERIES", "8"))
+CHART_CATEGORY_LIMIT = int(os.getenv("CORTEX_COST_CHART_CATEGORIES", "10"))
+OTHER_SERIES = "Other"
+
+def choose_granularity(start_date, end_date, max_points=CHART_POINT_BUDGET):
+    span = pd.Timestamp(end_date) - pd.Timestamp(start_date)
+    for granularity in GRANULARITIES:
+        if span / GRANULARITY_STEPS[granularity] <= max_points:
+            return granularity
+    return GRANULARITIES[-1]
+
+def explain_scan(session, query):
+    rows = [row.as_dict() for row in run_sql(session, "EXPLAIN USING TABULAR " + query).collect()]
+    stats = next((row for row in rows if row.get('operation') == 'GlobalStats'), rows[0] if rows else {})
+    return {
+        'PARTITIONS_TOTAL': stats.get('partitionsTotal'),
+        'PARTITIONS_ASSIGNED': stats.get('partitionsAssigned'),
+        'BYTES_ASSIGNED': stats.get('bytesAssigned'),
+    }
+
+def compare_query_history_plans(session, start_date, end_date):
+    plans = []
+    for label, prune in [("Unpruned join", False), ("Pruned join", True)]:
+        query = cortex_functions_query_rollup_query(start_date, end_date, prune_query_history=prune)
+        plans.append({'PLAN': label, **explain_scan(session, query)})
+    return pd.DataFrame(plans)
+
+def active_filter(selected, available):
+    if not selected or set(selected) == set(available):
+        return None
+    return tuple(sorted(selected))
+
+def combine_service_credits(frames):
+    all_data = [
+        with_constant_columns(df[['DATE', 'CREDITS'] + (['ACCOUNT'] if 'ACCOUNT' in df.columns else [])])
+        for df in frames
+        if not df.columns.empty
+    ]
+    combined_df = pd.concat(all_data, ignore_index=True)
+    combined_df['SERVICE_TYPE'] = combined_df['SERVICE_TYPE'].astype('category')
+    if 'ACCOUNT' in combined_df.columns:
+        combined_df['ACCOUNT'] = combined_df['ACCOUNT'].astype('category')
+    return combined_df
+
+def count_requests(df_analyst, df_query_functions):
+    total_requests = 0
+    if not df_analyst.empty:
+        total_requests += int(df_analyst['REQUESTS'].sum())
+    if not df_query_functions.empty:
+        total_requests += int(df_query_functions['REQUESTS'].sum())
+    return total_requests
+
+def cap_series(keys, weights, limit=CHART_SERIES_LIMIT):
+    totals = weights.groupby(keys, observed=True).sum()
+    if len(totals) <= limit:
+        return keys
+    top = totals.nlargest(limit).index
+    return keys.astype(object).where(keys.isin(top) | keys.isna(), OTHER_SERIES).astype('category')
+
+def daily_breakdown(df, column, measure='CREDITS', limit=CHART_SERIES_LIMIT):
+    series = cap_series(df[column], df[measure], limit) if limit else df[column]
+    return df.groupby([df['DATE'], series], observed=True)[measure].sum().reset_index()
+
+def credits_by(df, column, limit=None):
+    keys = cap_series(df[column], df['CREDITS'], limit) if limit else df[column]
+    return df.groupby(keys, observed=True)['CREDITS'].sum().sort_values(ascending=False)
+
+def token_efficiency(df, column, limit=None):
+    keys = cap_series(df[column], df['CREDITS'], limit) if limit else df[column]
+    rollup = df.groupby(keys, observed=True).agg({
+        'TOKENS': 'sum',
+        'CREDITS': 'sum'
+    }).reset_index()
+    rollup['CREDITS_PER_1M_TOKENS'] = (rollup['CREDITS'] / rollup['TOKENS']) * 1_000_000
+    return rollup
+
+def comparison_start(start_date, end_date):
+    return start_date - (end_date - start_date)
+
+def split_periods(df):
+    if 'PERIOD' not in df.columns:
+        return df, df.iloc[0:0]
+    is_current = (df['PERIOD'] == 'current').to_numpy()
+    parts = []
+    for mask, period in ((is_current, 'current'), (~is_current, 'previous')):
+        part = df[mask].drop(columns='PERIOD').reset_index(drop=True)
+        # Each period is its own frame for the filter mask cache.
+        if 'FRAME_ID' in df.attrs:
+            part.attrs['FRAME_ID'] = f"{df.attrs['FRAME_ID']}:{period}"
+        parts.append(part)
+    return tuple(parts)
+
+def percent_change(current, previous):
+    if not previous:
+        return None
+    # Floats, so numpy integer scalars can never wrap around when usage falls.
+    current, previous = float(current), float(previous)
+    return (current - previous) / previous
+
+def period_changes(current, previous, column, limit=CHART_CATEGORY_LIMIT):
+    changes = pd.DataFrame({
+        'CREDITS': credits_by(current, column).rename(index=str),
+        'PREVIOUS_CREDITS': credits_by(previous, column).rename(index=str) if not previous.empty else pd.Series(dtype='float64'),
+    }).fillna(0.0)
+    changes['CHANGE'] = changes['CREDITS'] - changes['PREVIOUS_CREDITS']
+    changes['CHANGE_PCT'] = changes['CHANGE'] / changes['PREVIOUS_CREDITS'].where(changes['PREVIOUS_CREDITS'] > 0)
+    ranked = changes['CHANGE'].abs().sort_values(ascending=False).index[:limit]
+    return changes.loc[ranked].rename_axis(column).reset_index()
+
+def with_account(df, account):
+    if df.columns.empty:
+        return df
+    return df.assign(ACCOUNT=pd.Categorical.from_codes(np.zeros(len(df), dtype='int8'), [account]))
+
+def merge_accounts(frames):
+    df = concat_frames([with_account(df, account) for account, df in frames.items()])
+    # Derived from the per-account frames, so a rerun over the same cached loads
+    # keeps reusing its filter masks while any newly loaded account changes the ID.
+    parts = sorted((str(account), str(df.attrs.get('FRAME_ID'))) for account, df in frames.items())
+    df.attrs['FRAME_ID'] = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return df
+
+def account_freshness(frames, errors):
+    rows = []
+    for account in dict.fromkeys([*frames, *errors]):
+        loaded = [df for df in frames.get(account, {}).values() if not df.columns.empty]
+        current = [split_periods(df)[0] for df in loaded]
+        dates = [df['DATE'].max() for df in current if 'DATE' in df.columns and not df.empty]
+        loaded_at = [df.attrs['LOADED_AT'] for df in loaded if 'LOADED_AT' in df.attrs]
+        account_errors = errors.get(account, {})
+        rows.append({
+            'ACCOUNT': account,
+            'STATUS': 'Failed' if account_errors and not loaded else 'Partial' if account_errors else 'OK',
+            'LOADED_AT': pd.Timestamp(min(loaded_at)) if loaded_at else pd.NaT,
+            'LATEST_USAGE': max(dates) if dates else pd.NaT,
+            'ERRORS': "; ".join(f"{service}: {error}" for service, error in account_errors.items()),
+        })
+    return pd.DataFrame(rows, columns=['ACCOUNT', 'STATUS', 'LOADED_AT', 'LATEST_USAGE', 'ERRORS'])
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+QUERY_TAG_APP = os.getenv("CORTEX_COST_QUERY_TAG", "cortex_cost_monitor")
+
+logger = logging.getLogger("cortex_cost_monitor")
+
+_records = ContextVar("cortex_cost_records", default=None)
+_scope = ContextVar("cortex_cost_loader_scope", default=None)
+
+
+def start_run():
+    records = []
+    _records.set(records)
+    return records
+
+
+def query_tag(loader=None):
+    return json.dumps({"app": QUERY_TAG_APP, "loader": loader})
+
+
+def current_loader():
+    scope = _scope.get()
+    return scope['loader'] if scope else None
+
+
+def statement_params():
+    return {"QUERY_TAG": query_tag(current_loader())}
+
+
+def record(event, **fields):
+    entry = {'EVENT': event, 'LOADER': current_loader(), **fields}
+    scope = _scope.get()
+    if scope is not None and event == 'query':
+        scope['queries'] += 1
+    logger.info(json.dumps(entry, default=str))
+    records = _records.get()
+    if records is not None:
+        records.append(entry)
+    return entry
+
+
+@contextmanager
+def loader_scope(loader):
+    scope = {'loader': loader, 'queries': 0}
+    token = _scope.set(scope)
+    started = time.perf_counter()
+    try:
+        yield scope
+    finally:
+        # No query recorded inside the scope means every result came from st.cache_data.
+        record(
+            'loader',
+            SECONDS=time.perf_counter() - started,
+            CACHE='miss' if scope['queries'] else 'hit',
+        )
+        _scope.reset(token)
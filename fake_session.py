@@ -0,0 +1,341 @@
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+MODELS = ['claude-3-5-sonnet', 'llama3.1-70b', 'mistral-large2', 'snowflake-arctic', 'e5-base-v2', '']
+FUNCTIONS = ['COMPLETE', 'SUMMARIZE', 'TRANSLATE', 'SENTIMENT', 'EMBED_TEXT_768', 'AI_CLASSIFY']
+WAREHOUSES = ['COMPUTE_WH', 'ANALYTICS_WH', 'ETL_WH', 'CORTEX_WH', 'ADHOC_WH']
+
+TRUNC_UNITS = {'HOUR': 'h', 'DAY': 'D'}
+PERIOD_UNITS = {'WEEK': 'W-SUN', 'MONTH': 'M'}
+
+
+def _timestamps(rng, count, start, end):
+    hours = int((end - start) / timedelta(hours=1))
+    offsets = rng.integers(0, max(hours, 1), count)
+    return pd.Timestamp(start).floor('h') + pd.to_timedelta(offsets, unit='h')
+
+
+def generate_usage_tables(rows, days=90, end=None, seed=0):
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or datetime.now()).floor('h')
+    start = end - timedelta(days=days)
+    warehouse_ids = np.arange(1, len(WAREHOUSES) + 1)
+
+    def usage_rows(count):
+        start_time = _timestamps(rng, count, start, end)
+        return start_time, start_time + pd.Timedelta(hours=1)
+
+    query_rows = max(rows, 1)
+    start_time, end_time = usage_rows(query_rows)
+    query_usage = pd.DataFrame({
+        'QUERY_ID': np.char.add('01b', np.arange(query_rows).astype(str)),
+        'WAREHOUSE_ID': rng.choice(warehouse_ids, query_rows),
+        'MODEL_NAME': rng.choice(MODELS, query_rows),
+        'FUNCTION_NAME': rng.choice(FUNCTIONS, query_rows),
+        'TOKENS': rng.integers(10, 20_000, query_rows),
+        'TOKEN_CREDITS': rng.gamma(2.0, 0.0005, query_rows),
+        # Stands in for the QUERY_HISTORY join, which supplies these in Snowflake.
+        'START_TIME': start_time,
+        'END_TIME': end_time,
+    })
+
+    function_rows = max(rows // 4, 1)
+    start_time, end_time = usage_rows(function_rows)
+    functions_usage = pd.DataFrame({
+        'START_TIME': start_time,
+        'END_TIME': end_time,
+        'FUNCTION_NAME': rng.choice(FUNCTIONS, function_rows),
+        'MODEL_NAME': rng.choice(MODELS, function_rows),
+        'WAREHOUSE_ID': rng.choice(warehouse_ids, function_rows),
+        'TOKEN_CREDITS': rng.gamma(2.0, 0.002, function_rows),
+        'TOKENS': rng.integers(100, 80_000, function_rows),
+    })
+
+    service_rows = max(rows // 20, 1)
+    start_time, end_time = usage_rows(service_rows)
+    analyst_usage = pd.DataFrame({
+        'START_TIME': start_time,
+        'END_TIME': end_time,
+        'USERNAME': rng.choice(['ANALYST_1', 'ANALYST_2', 'SVC_BI'], service_rows),
+        'CREDITS': rng.gamma(2.0, 0.05, service_rows),
+        'REQUEST_COUNT': rng.integers(1, 50, service_rows),
+    })
+
+    start_time, end_time = usage_rows(service_rows)
+    search_service = rng.integers(0, 3, service_rows)
+    search_usage = pd.DataFrame({
+        'START_TIME': start_time,
+        'END_TIME': end_time,
+        'DATABASE_NAME': 'DOCS_DB',
+        'SCHEMA_NAME': 'PUBLIC',
+        'SERVICE_NAME': np.array(['KB_SEARCH', 'TICKET_SEARCH', 'CODE_SEARCH'])[search_service],
+        'SERVICE_ID': search_service + 100,
+        'CREDITS': rng.gamma(2.0, 0.0001, service_rows),
+    })
+
+    warehouse_metering = pd.DataFrame({
+        'START_TIME': [start] * len(WAREHOUSES),
+        'WAREHOUSE_ID': warehouse_ids,
+        'WAREHOUSE_NAME': WAREHOUSES,
+    })
+
+    return {
+        'CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY': query_usage,
+        'CORTEX_FUNCTIONS_USAGE_HISTORY': functions_usage,
+        'CORTEX_ANALYST_USAGE_HISTORY': analyst_usage,
+        'CORTEX_SEARCH_SERVING_USAGE_HISTORY': search_usage,
+        'WAREHOUSE_METERING_HISTORY': warehouse_metering,
+    }
+
+
+class FakeRow(dict):
+    def as_dict(self):
+        return dict(self)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+def _split_top_level(text):
+    items, depth, current = [], 0, []
+    for char in text:
+        depth += char == '('
+        depth -= char == ')'
+        if char == ',' and depth == 0:
+            items.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        items.append(''.join(current).strip())
+    return items
+
+
+def _inline_params(query, params):
+    # Binds are substituted as literals so the regex-based evaluator sees the same text as before.
+    if not params:
+        return query
+    values = iter(params)
+
+    def literal(_):
+        value = next(values)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    inlined = re.sub(r'\?', literal, query)
+    if next(values, None) is not None:
+        raise ValueError("More bind values than placeholders")
+    return inlined
+
+
+def _truncate(series, unit):
+    unit = unit.upper()
+    if unit in TRUNC_UNITS:
+        return series.dt.floor(TRUNC_UNITS[unit])
+    return series.dt.to_period(PERIOD_UNITS[unit]).dt.start_time
+
+
+class FakeAsyncJob:
+    def __init__(self, dataframe):
+        self.dataframe = dataframe
+        self.query_id = f"01fake-{len(dataframe.session.queries):06d}"
+
+    def result(self, result_type="row"):
+        if result_type == "pandas_batches":
+            return self.dataframe.to_pandas_batches()
+        if result_type == "pandas":
+            return self.dataframe.to_pandas()
+        return self.dataframe.collect()
+
+
+class FakeDataFrame:
+    def __init__(self, session, query):
+        self.session = session
+        self.query = query
+
+    def to_pandas(self, statement_params=None):
+        return self.session.execute(self.query)
+
+    def collect_nowait(self, statement_params=None):
+        self.session.statement_params.append(statement_params)
+        return FakeAsyncJob(self)
+
+    def to_pandas_batches(self, statement_params=None):
+        df = self.to_pandas()
+        for offset in range(0, len(df), self.session.batch_rows):
+            yield df.iloc[offset:offset + self.session.batch_rows].reset_index(drop=True)
+
+    def collect(self, statement_params=None):
+        return [FakeRow(row) for row in self.to_pandas().to_dict('records')]
+
+
+class FakeSession:
+    def __init__(self, tables=None, rows=10_000, days=90, batch_rows=100_000):
+        self.tables = tables if tables is not None else generate_usage_tables(rows, days=days)
+        self.batch_rows = batch_rows
+        self.queries = []
+        self.unloaded = []
+        self.statement_params = []
+        self.query_tag = None
+
+    def sql(self, query, params=None):
+        query = _inline_params(query, params)
+        self.queries.append(query)
+        return FakeDataFrame(self, query)
+
+    def close(self):
+        pass
+
+    def execute(self, query):
+        if 'CURRENT_ACCOUNT()' in query:
+            return pd.DataFrame([{'CURRENT_ACCOUNT()': 'FAKE', 'CURRENT_USER()': 'FAKE_USER', 'CURRENT_ROLE()': 'FAKE_ROLE'}])
+        if query.lstrip().upper().startswith('EXPLAIN'):
+            return self._explain(query)
+
+        subquery = re.search(r'FROM\s*\(', query)
+        if query.lstrip().upper().startswith('COPY INTO'):
+            unloaded = self.execute(query[subquery.end():self._closing_paren(query, subquery.end())])
+            self.unloaded.append(unloaded)
+            return pd.DataFrame([{'rows_unloaded': len(unloaded)}])
+        if subquery:
+            return self._execute_subquery(query, subquery.end())
+
+        source = self._source(query)
+        if source not in self.tables:
+            raise RuntimeError(f"Object '{source}' does not exist or not authorized.")
+        df = self._apply_predicates(self.tables[source], query)
+
+        if re.search(r'\bQUALIFY\b', query):
+            latest = df.sort_values('START_TIME').drop_duplicates('WAREHOUSE_ID', keep='last')
+            return latest[['WAREHOUSE_ID', 'WAREHOUSE_NAME']].reset_index(drop=True)
+        if re.match(r'\s*SELECT 1 FROM', query):
+            return pd.DataFrame({'1': [1]}).head(min(len(df), 1))
+
+        result = self._project(df, query)
+        return self._order_and_limit(result, query)
+
+    def _closing_paren(self, query, inner_start):
+        depth = 1
+        for position in range(inner_start, len(query)):
+            depth += {'(': 1, ')': -1}.get(query[position], 0)
+            if depth == 0:
+                return position
+        raise ValueError("Unbalanced parentheses in query")
+
+    def _execute_subquery(self, query, inner_start):
+        position = self._closing_paren(query, inner_start)
+        df = self.execute(query[inner_start:position])
+        outer = query[:inner_start - 1] + ' d' + query[position + 1:]
+        return self._order_and_limit(self._project(self._apply_predicates(df, outer), outer), outer)
+
+    def _source(self, query):
+        for name in self.tables:
+            if re.search(rf'FROM\s+(SNOWFLAKE\.ACCOUNT_USAGE\.)?{name}\b', query):
+                return name
+        match = re.search(r'FROM\s+([\w.]+)', query)
+        return match.group(1).split('.')[-1] if match else None
+
+    def _apply_predicates(self, df, query):
+        where = query.split('WHERE', 1)[1] if 'WHERE' in query else ''
+        mask = np.ones(len(df), dtype=bool)
+        pattern = r"\b(\w+)\s*(>=|<=|<|>|=)\s*(?:DATE_TRUNC\('\w+',\s*)?'([^']*)'"
+        for column, operator, literal in re.findall(pattern, where):
+            if column not in df.columns:
+                continue
+            values = df[column]
+            value = pd.Timestamp(literal) if pd.api.types.is_datetime64_any_dtype(values) else literal
+            mask &= {
+                '>=': values >= value, '<=': values <= value, '<': values < value,
+                '>': values > value, '=': values == value,
+            }[operator].to_numpy()
+        for column, literals in re.findall(r"(\w+) IN \(([^)]*)\)", where):
+            column = 'MODEL_NAME' if column == 'END' else column
+            values = [value.strip().strip("'") for value in literals.split(',')]
+            if pd.api.types.is_numeric_dtype(df[column]):
+                values = [float(value) for value in values]
+            mask &= self._model_names(df[column]).isin(values).to_numpy() if column == 'MODEL_NAME' else df[column].isin(values).to_numpy()
+        for column, pattern in re.findall(r"(\w+) ILIKE '([^']*)'(?: ESCAPE '!')?", where):
+            text = re.sub(r"!(.)", r"\1", pattern[1:-1])
+            mask &= df[column].astype(str).str.contains(text, case=False, regex=False).to_numpy()
+        return df[mask]
+
+    def _model_names(self, series):
+        return series.where(series.fillna('').str.strip() != '', 'internal-models')
+
+    def _column(self, df, expression):
+        expression = expression.strip()
+        literal = re.fullmatch(r"'([^']*)'", expression)
+        if literal:
+            return literal.group(1)
+        trunc = re.fullmatch(r"DATE_TRUNC\('(\w+)',\s*([\w.]+)\)", expression)
+        if trunc:
+            return _truncate(df[trunc.group(2).split('.')[-1]], trunc.group(1))
+        period = re.fullmatch(
+            r"IFF\(([\w.]+) >= (?:DATE_TRUNC\('(\w+)',\s*)?'([^']*)'(?:::\w+)?\)?, '(\w+)', '(\w+)'\)", expression
+        )
+        if period:
+            column, unit, literal, when_true, when_false = period.groups()
+            bound = pd.Timestamp(literal)
+            bound = _truncate(pd.Series([bound]), unit).iloc[0] if unit else bound
+            return np.where(df[column.split('.')[-1]] >= bound, when_true, when_false)
+        if expression.startswith('CASE') and 'MODEL_NAME' in expression:
+            return self._model_names(df['MODEL_NAME'])
+        return df[expression.split('.')[-1]]
+
+    def _project(self, df, query):
+        select = re.search(r'SELECT(.*?)\n\s*FROM', query, re.S).group(1)
+        items = []
+        for item in _split_top_level(select):
+            match = re.fullmatch(r'(.*?)\s+as\s+(\w+)', item, re.S | re.I)
+            expression, alias = (match.group(1), match.group(2)) if match else (item, item.split('.')[-1])
+            items.append((expression.strip(), alias))
+
+        if items == [('*', '*')]:
+            return df.reset_index(drop=True)
+        aggregates = [(e, a) for e, a in items if re.match(r'(SUM|COUNT)\(', e)]
+        if not aggregates and 'GROUP BY' not in query:
+            return pd.DataFrame({alias: self._column(df, expression) for expression, alias in items}).reset_index(drop=True)
+
+        constants = {a: e.strip("'") for e, a in items if re.fullmatch(r"'[^']*'", e)}
+        dimensions = [(e, a) for e, a in items if (e, a) not in aggregates and a not in constants]
+        frame = pd.DataFrame({alias: self._column(df, expression) for expression, alias in dimensions}, index=df.index)
+        for expression, alias in aggregates:
+            inner = re.match(r'(SUM|COUNT)\((.*)\)', expression).group(2)
+            frame[alias] = 1 if inner == '*' else df[inner.split('.')[-1]]
+        if dimensions:
+            result = frame.groupby([a for _, a in dimensions], dropna=False).sum().reset_index()
+        else:
+            result = frame.sum().to_frame().T if len(frame) else frame
+        return result.assign(**constants)
+
+    def _order_and_limit(self, df, query):
+        orders = re.findall(r'ORDER BY\s+([^\n]+)', query)
+        if orders and not df.empty:
+            columns, ascending = [], []
+            for term in orders[-1].split(','):
+                column, *direction = term.split()
+                columns.append(df.columns[int(column) - 1] if column.isdigit() else column.split('.')[-1])
+                ascending.append(not direction or direction[0].upper() != 'DESC')
+            df = df.sort_values(columns, ascending=ascending, ignore_index=True)
+        limit = re.search(r'LIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?', query)
+        if limit:
+            offset = int(limit.group(2) or 0)
+            df = df.iloc[offset:offset + int(limit.group(1))].reset_index(drop=True)
+        return df
+
+    def _explain(self, query):
+        source = self._source(query[len('EXPLAIN USING TABULAR'):]) or ''
+        table = self.tables.get(source, pd.DataFrame())
+        total_bytes = int(table.memory_usage(deep=True).sum()) if not table.empty else 0
+        return pd.DataFrame([{
+            'operation': 'GlobalStats',
+            'partitionsTotal': max(total_bytes // 16_000_000, 1),
+            'partitionsAssigned': max(total_bytes // 16_000_000, 1),
+            'bytesAssigned': total_bytes,
+        }])
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+
+SESSION_MODE = os.getenv("CORTEX_COST_SESSION_MODE", "live")
+FIXTURE_DIR = os.getenv("CORTEX_COST_FIXTURE_DIR", "fixtures")
+REPLAY_LATENCY_MS = int(os.getenv("CORTEX_COST_REPLAY_LATENCY_MS", "0"))
+SYNTHETIC_ROWS = int(os.getenv("CORTEX_COST_SYNTHETIC_ROWS", "100000"))
+REPLAY_BATCH_ROWS = 100_000
+
+MANIFEST = "manifest.json"
+
+
+class ReplayError(RuntimeError):
+    pass
+
+
+class FixtureNotFound(ReplayError):
+    pass
+
+
+def fixture_key(query, params=None):
+    # Same normalization as the result cache: whitespace-only differences share a fixture.
+    normalized = " ".join(query.split())
+    return hashlib.sha256(json.dumps([normalized, params], default=str).encode()).hexdigest()
+
+
+class FixtureStore:
+    def __init__(self, root=FIXTURE_DIR):
+        self.root = root
+
+    def _path(self, key, suffix):
+        return os.path.join(self.root, f"{key}{suffix}")
+
+    def start_recording(self):
+        os.makedirs(self.root, exist_ok=True)
+        recorded_at = datetime.now()
+        with open(os.path.join(self.root, MANIFEST), 'w') as f:
+            json.dump({'recorded_at': recorded_at.isoformat()}, f)
+        return recorded_at
+
+    def recorded_at(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST)) as f:
+                return datetime.fromisoformat(json.load(f)['recorded_at'])
+        except FileNotFoundError:
+            return None
+
+    def load(self, query, params=None):
+        key = fixture_key(query, params)
+        error_path = self._path(key, '.error')
+        if os.path.exists(error_path):
+            with open(error_path) as f:
+                raise ReplayError(f.read())
+        try:
+            return pd.read_parquet(self._path(key, '.parquet'))
+        except FileNotFoundError:
+            raise FixtureNotFound(f"No recorded result for query {key[:12]}: {' '.join(query.split())[:200]}")
+
+    def save(self, query, params, df):
+        os.makedirs(self.root, exist_ok=True)
+        key = fixture_key(query, params)
+        path = self._path(key, '.parquet')
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        if os.path.exists(self._path(key, '.error')):
+            os.remove(self._path(key, '.error'))
+
+    def save_error(self, query, params, error):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path(fixture_key(query, params), '.error'), 'w') as f:
+            f.write(str(error))
+
+
+class ReplayRow(dict):
+    def as_dict(self):
+        return dict(self)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+class ReplayJob:
+    def __init__(self, frame, statement_params):
+        self.frame = frame
+        self.statement_params = statement_params
+        self.query_id = f"replay-{fixture_key(frame.query, frame.params)[:16]}"
+
+    def result(self, result_type="row"):
+        if result_type == "pandas_batches":
+            return self.frame.to_pandas_batches(self.statement_params)
+        if result_type == "pandas":
+            return self.frame.to_pandas(self.statement_params)
+        return self.frame.collect(self.statement_params)
+
+
+class ReplayDataFrame:
+    # The subset of the Snowpark DataFrame API the app and cortex_usage call.
+    def __init__(self, fetch, query, params=None, batch_rows=REPLAY_BATCH_ROWS):
+        self.fetch = fetch
+        self.query = query
+        self.params = params
+        self.batch_rows = batch_rows
+
+    def to_pandas(self, statement_params=None):
+        return self.fetch(self.query, self.params, statement_params)
+
+    def to_pandas_batches(self, statement_params=None):
+        df = self.to_pandas(statement_params)
+        for offset in range(0, len(df), self.batch_rows):
+            yield df.iloc[offset:offset + self.batch_rows].reset_index(drop=True)
+
+    def collect(self, statement_params=None):
+        return [ReplayRow(row) for row in self.to_pandas(statement_params).to_dict('records')]
+
+    def collect_nowait(self, statement_params=None):
+        return ReplayJob(self, statement_params)
+
+
+class ReplaySession:
+    def __init__(self, store, latency_seconds=0.0, fallback=None):
+        self.store = store
+        self.latency_seconds = latency_seconds
+        self.fallback = fallback
+        self.recorded_at = store.recorded_at() if store is not None else None
+        self.query_tag = None
+
+    def sql(self, query, params=None):
+        return ReplayDataFrame(self._fetch, query, params)
+
+    def _fetch(self, query, params, statement_params):
+        # Stands in for warehouse queueing and network time so loaders behave like they do live.
+        time.sleep(self.latency_seconds)
+        try:
+            if self.store is None:
+                raise FixtureNotFound(query)
+            return self.store.load(query, params)
+        except FixtureNotFound:
+            if self.fallback is None:
+                raise
+            dataframe = self.fallback.sql(query) if params is None else self.fallback.sql(query, params=params)
+            return dataframe.to_pandas()
+
+    def close(self):
+        pass
+
+
+class RecordingSession:
+    def __init__(self, session, store):
+        self.session = session
+        self.store = store
+        self.recorded_at = store.start_recording()
+
+    @property
+    def query_tag(self):
+        return self.session.query_tag
+
+    @query_tag.setter
+    def query_tag(self, value):
+        self.session.query_tag = value
+
+    def sql(self, query, params=None):
+        return ReplayDataFrame(self._fetch, query, params)
+
+    def _fetch(self, query, params, statement_params):
+        dataframe = self.session.sql(query) if params is None else self.session.sql(query, params=params)
+        try:
+            df = dataframe.to_pandas(statement_params=statement_params)
+        except Exception as e:
+            # Failures replay too, so checks such as table_coverage answer the same offline.
+            self.store.save_error(query, params, e)
+            raise
+        self.store.save(query, params, df)
+        return df
+
+    def close(self):
+        self.session.close()
+
+
+def fixture_root(connection_name=None, root=FIXTURE_DIR):
+    # Each account records into its own directory: the same SQL returns different rows per account.
+    return os.path.join(root, connection_name) if connection_name else root
+
+
+def local_session(
+    create_live_session, mode=SESSION_MODE, root=FIXTURE_DIR, latency_seconds=REPLAY_LATENCY_MS / 1000,
+    connection_name=None
+):
+    root = fixture_root(connection_name, root)
+    if mode == "replay":
+        return ReplaySession(FixtureStore(root), latency_seconds)
+    if mode == "synthetic":
+        from fake_session import FakeSession
+        return ReplaySession(FixtureStore(root), latency_seconds, fallback=FakeSession(rows=SYNTHETIC_ROWS))
+    session = create_live_session()
+    if mode == "record":
+        return RecordingSession(session, FixtureStore(root))
+    return session
+
+
+def session_clock(session):
+    # Recorded queries embed their date window, so replays run at the time they were recorded.
+    return getattr(session, 'recorded_at', None) or datetime.now()
+
+
+def fixture_clock(connection_name=None, mode=SESSION_MODE, root=FIXTURE_DIR):
+    # The same clock as session_clock, read from the fixtures without opening a session.
+    if mode in ("replay", "synthetic"):
+        return FixtureStore(fixture_root(connection_name, root)).recorded_at() or datetime.now()
+    return datetime.now()
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("CORTEX_COST_RESULT_CACHE_TTL_SECONDS", "900"))
+RESULT_CACHE_MAX_MB = int(os.getenv("CORTEX_COST_RESULT_CACHE_MAX_MB", "512"))
+
+
+def query_fingerprint(query, role):
+    # Whitespace differences between builders should not split cache entries;
+    # the role is part of the key so a result is only served to the role that
+    # was entitled to read it. Bind values are part of the key as well.
+    normalized = " ".join(str(query).split())
+    params = json.dumps(getattr(query, 'params', ()), default=str)
+    return hashlib.sha256(f"{role}\n{normalized}\n{params}".encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root, ttl_seconds=RESULT_CACHE_TTL_SECONDS, max_bytes=RESULT_CACHE_MAX_MB * 1_000_000):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.counters = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+    def _path(self, query, role):
+        return os.path.join(self.root, f"{query_fingerprint(query, role)}.parquet")
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, query, role):
+        path = self._path(query, role)
+        try:
+            written = os.path.getmtime(path)
+            if time.time() - written > self.ttl_seconds:
+                self._remove(path)
+                raise FileNotFoundError(path)
+            df = pd.read_parquet(path)
+        except (FileNotFoundError, OSError, ValueError):
+            # Missing, expired, or removed by another replica mid-read.
+            self._count('misses')
+            return None
+        # mtime keeps the write time for the TTL; atime records the last hit for LRU.
+        os.utime(path, (time.time(), written))
+        self._count('hits')
+        return df
+
+    def put(self, query, role, df):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(query, role)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self._count('writes')
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.parquet'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        entries = []
+        for last_used, written, size, path in self._entries():
+            if now - written > self.ttl_seconds:
+                self._remove(path)
+                self._count('evictions')
+            else:
+                entries.append((last_used, size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            self._count('evictions')
+            total -= size
+
+    def metrics(self):
+        entries = self._entries() if os.path.isdir(self.root) else []
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            **counters,
+            'hit_rate': counters['hits'] / lookups if lookups else None,
+            'entries': len(entries),
+            'size_mb': sum(size for _, _, size, _ in entries) / 1_000_000,
+        }
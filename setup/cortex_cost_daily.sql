@@ -0,0 +1,119 @@
+-- Optional daily rollup of Cortex usage for the Cortex Cost Monitor.
+--
+-- Run with setup/install_rollup.py, or replace the {{...}} placeholders and run
+-- in a worksheet with the database and schema the app is deployed to selected.
+-- The role needs access to SNOWFLAKE.ACCOUNT_USAGE and EXECUTE TASK.
+
+CREATE TABLE IF NOT EXISTS CORTEX_COST_DAILY (
+    DAY TIMESTAMP_LTZ NOT NULL,
+    SERVICE_TYPE VARCHAR NOT NULL,
+    MODEL_NAME VARCHAR,
+    FUNCTION_NAME VARCHAR,
+    WAREHOUSE_ID NUMBER,
+    CREDITS FLOAT,
+    TOKENS NUMBER,
+    REQUESTS NUMBER
+)
+CLUSTER BY (DAY);
+
+CREATE OR REPLACE PROCEDURE REFRESH_CORTEX_COST_DAILY(LOOKBACK_DAYS NUMBER)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    refresh_from TIMESTAMP_LTZ;
+BEGIN
+    -- Recompute the trailing days so rows that land late in ACCOUNT_USAGE are picked up.
+    SELECT COALESCE(DATEADD('DAY', -:LOOKBACK_DAYS, MAX(DAY)), DATEADD('YEAR', -1, DATE_TRUNC('DAY', CURRENT_TIMESTAMP())))
+        INTO :refresh_from
+        FROM CORTEX_COST_DAILY;
+
+    BEGIN TRANSACTION;
+
+    DELETE FROM CORTEX_COST_DAILY WHERE DAY >= :refresh_from;
+
+    INSERT INTO CORTEX_COST_DAILY (DAY, SERVICE_TYPE, MODEL_NAME, FUNCTION_NAME, WAREHOUSE_ID, CREDITS, TOKENS, REQUESTS)
+    SELECT 
+        DATE_TRUNC('DAY', START_TIME),
+        'Cortex Analyst',
+        NULL,
+        NULL,
+        NULL,
+        SUM(CREDITS),
+        NULL,
+        SUM(REQUEST_COUNT)
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_ANALYST_USAGE_HISTORY
+    WHERE START_TIME >= :refresh_from
+    GROUP BY 1
+
+    UNION ALL
+
+    SELECT 
+        DATE_TRUNC('DAY', f.START_TIME),
+        'Cortex Functions',
+        CASE 
+            WHEN f.MODEL_NAME IS NULL OR TRIM(f.MODEL_NAME) = '' THEN 'internal-models'
+            ELSE f.MODEL_NAME 
+        END,
+        f.FUNCTION_NAME,
+        f.WAREHOUSE_ID,
+        SUM(f.TOKEN_CREDITS),
+        SUM(f.TOKENS),
+        NULL
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_USAGE_HISTORY f
+    WHERE f.START_TIME >= :refresh_from
+    GROUP BY 1, 3, 4, 5
+
+    UNION ALL
+
+    SELECT 
+        DATE_TRUNC('DAY', qh.START_TIME),
+        'Cortex Functions Query',
+        CASE 
+            WHEN q.MODEL_NAME IS NULL OR TRIM(q.MODEL_NAME) = '' THEN 'internal-models'
+            ELSE q.MODEL_NAME 
+        END,
+        q.FUNCTION_NAME,
+        q.WAREHOUSE_ID,
+        SUM(q.TOKEN_CREDITS),
+        SUM(q.TOKENS),
+        COUNT(*)
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY q
+    JOIN (
+        SELECT QUERY_ID, START_TIME
+        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+        WHERE START_TIME >= :refresh_from
+    ) qh ON q.QUERY_ID = qh.QUERY_ID
+    GROUP BY 1, 3, 4, 5
+
+    UNION ALL
+
+    SELECT 
+        DATE_TRUNC('DAY', START_TIME),
+        'Cortex Search',
+        NULL,
+        NULL,
+        NULL,
+        SUM(CREDITS),
+        NULL,
+        NULL
+    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_SEARCH_SERVING_USAGE_HISTORY
+    WHERE START_TIME >= :refresh_from
+    GROUP BY 1;
+
+    COMMIT;
+
+    RETURN 'CORTEX_COST_DAILY refreshed from ' || TO_VARCHAR(:refresh_from);
+END;
+$$;
+
+CREATE OR REPLACE TASK REFRESH_CORTEX_COST_DAILY_TASK
+    WAREHOUSE = {{WAREHOUSE}}
+    SCHEDULE = '{{SCHEDULE}}'
+AS
+    CALL REFRESH_CORTEX_COST_DAILY({{LOOKBACK_DAYS}});
+
+ALTER TASK REFRESH_CORTEX_COST_DAILY_TASK RESUME;
+
+CALL REFRESH_CORTEX_COST_DAILY({{LOOKBACK_DAYS}});
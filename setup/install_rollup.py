@@ -0,0 +1,55 @@
+import argparse
+import os
+
+SETUP_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cortex_cost_daily.sql")
+
+
+def split_statements(script):
+    statements = []
+    current = []
+    in_block = False
+    for line in script.splitlines():
+        if not current and (not line.strip() or line.strip().startswith("--")):
+            continue
+        current.append(line)
+        in_block ^= line.count("$$") % 2 == 1
+        if not in_block and line.rstrip().endswith(";"):
+            statements.append("\n".join(current).rstrip().rstrip(";"))
+            current = []
+    return statements
+
+
+def render_script(warehouse, schedule, lookback_days):
+    with open(SETUP_SQL) as f:
+        script = f.read()
+    return (
+        script
+        .replace("{{WAREHOUSE}}", warehouse)
+        .replace("{{SCHEDULE}}", schedule)
+        .replace("{{LOOKBACK_DAYS}}", str(lookback_days))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install the CORTEX_COST_DAILY rollup table and refresh task.")
+    parser.add_argument("--connection", default=os.getenv("SNOWFLAKE_CONNECTION_NAME") or "demo")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--schema", required=True)
+    parser.add_argument("--warehouse", required=True)
+    parser.add_argument("--schedule", default="60 MINUTE")
+    parser.add_argument("--lookback-days", type=int, default=3)
+    args = parser.parse_args()
+
+    from snowflake.snowpark import Session
+    session = Session.builder.config('connection_name', args.connection).create()
+    try:
+        session.use_database(args.database)
+        session.use_schema(args.schema)
+        for statement in split_statements(render_script(args.warehouse, args.schedule, args.lookback_days)):
+            print(session.sql(statement).collect()[0][0])
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
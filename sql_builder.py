@@ -0,0 +1,68 @@
+import numbers
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+
+class Query:
+    # SQL text with positional `?` binds; adding queries keeps text and binds in the same order.
+    def __init__(self, text, params=()):
+        self.text = text
+        self.params = tuple(params)
+
+    def __add__(self, other):
+        other = other if isinstance(other, Query) else Query(other)
+        return Query(self.text + other.text, self.params + other.params)
+
+    def __radd__(self, other):
+        return Query(other) + self
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"Query({self.text!r}, {self.params!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and (self.text, self.params) == (other.text, other.params)
+
+    def __hash__(self):
+        return hash((self.text, self.params))
+
+
+def bind_value(value):
+    # One canonical form per value, so equal windows and filters always bind identically.
+    if isinstance(value, (datetime, date, pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat(sep=' ')
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, numbers.Number):
+        return value
+    return str(value)
+
+
+def bind(text, *values):
+    return Query(text, [bind_value(value) for value in values])
+
+
+def timestamp_bind(value):
+    return bind("?::TIMESTAMP_LTZ", value)
+
+
+def in_list(expression, values):
+    values = sorted({bind_value(value) for value in values}, key=str)
+    return bind(f"{expression} IN ({', '.join('?' for _ in values)})", *values)
+
+
+def join(queries, separator):
+    combined = Query("")
+    for position, query in enumerate(queries):
+        combined = combined + (separator if position else "") + query
+    return combined
+
+
+def run_sql(session, query):
+    if isinstance(query, Query) and query.params:
+        return session.sql(query.text, params=list(query.params))
+    return session.sql(str(query))
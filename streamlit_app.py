@@ -1,8 +1,34 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
+import contextvars
+import copy
+import logging
+import math
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import altair as alt
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from anomalies import credit_series, detect_anomalies, settled_bucket
+from charts import bar_chart, chart_rows, efficiency_color, spec_size, time_area_chart, with_anomalies
+from diagnostics import loader_scope, logger, query_tag, record, start_run
+from replay_session import fixture_clock, local_session, session_clock
+from result_cache import ResultCache
+from sql_builder import run_sql
+from usage_store import UsageStore
+from cortex_usage import (
+    CHART_CATEGORY_LIMIT, DETAIL_COLUMNS, DETAIL_PAGE_SIZE, EXPORT_FORMATS, EXPORT_STAGE,
+    EXPORT_STAGE_ROWS, ROLLUP_TABLE, USAGE_KEY_COLUMNS, USAGE_QUERIES, account_freshness, active_filter,
+    apply_function_filters, attach_warehouse_names, choose_granularity, combine_service_credits,
+    compare_query_history_plans, comparison_start, cortex_analyst_rollup_query,
+    cortex_functions_query_rollup_query, cortex_functions_rollup_query, cortex_functions_usage_query,
+    cortex_search_rollup_query, count_requests, credits_by, daily_breakdown, detail_count_query,
+    detail_page_query, export_is_fresh, export_path, export_signature, filter_signature, frame_memory,
+    load_rollup, merge_accounts, percent_change, period_changes, query_frame, snap_window, split_periods,
+    stage_export_location, stage_export_query, table_coverage, token_efficiency, usage_batches,
+    warehouse_dimension_query, warehouse_ids_for, write_export,
+)
 
 st.set_page_config(
     layout="wide",
@@ -10,138 +36,412 @@ st.set_page_config(
     page_title="Cortex Cost Monitor"
 )
 
+@st.cache_resource
 def is_running_in_sis():
     try:
         from snowflake.snowpark.context import get_active_session
         get_active_session()
         return True
-    except:
+    except Exception:
         return False
 
 def get_sis_connection():
     from snowflake.snowpark.context import get_active_session
     return get_active_session()
 
-def get_local_connection():
+CONNECTION_NAMES = [name.strip() for name in os.getenv("SNOWFLAKE_CONNECTION_NAMES", "").split(",") if name.strip()]
+
+def primary_connection_name():
+    return os.getenv("SNOWFLAKE_CONNECTION_NAME") or (CONNECTION_NAMES or ["demo"])[0]
+
+def get_local_connection(connection_name=None):
     from snowflake.snowpark import Session
-    if 'session' not in st.session_state or st.session_state.session is None:
-        st.session_state.session = Session.builder.config(
-            'connection_name', 
-            os.getenv("SNOWFLAKE_CONNECTION_NAME") or "demo"
-        ).create()
-    return st.session_state.session
+    return local_session(lambda: Session.builder.config(
+        'connection_name', 
+        connection_name or primary_connection_name()
+    ).create(), connection_name=connection_name)
 
+@st.cache_resource
 def get_session():
     if is_running_in_sis():
-        return get_sis_connection()
+        session = get_sis_connection()
     else:
-        return get_local_connection()
+        session = get_local_connection()
+    return with_query_tag(session)
+
+@st.cache_resource
+def get_account_session(connection_name):
+    return with_query_tag(get_local_connection(connection_name))
+
+def with_query_tag(session):
+    try:
+        session.query_tag = query_tag()
+    except Exception:
+        pass
+    return session
+
+def multi_account_mode():
+    return len(CONNECTION_NAMES) > 1 and not is_running_in_sis()
+
+def primary_session():
+    # With several accounts the primary connection is only opened for detail rows, exports and the plan check.
+    if multi_account_mode():
+        return get_account_session(primary_connection_name())
+    return session
+
+def primary_connection_error():
+    try:
+        primary_session()
+        return None
+    except Exception as e:
+        return f"Could not connect to the primary connection {primary_connection_name()}: {e}"
+
+@st.cache_resource
+def configure_query_log():
+    log_path = os.getenv("CORTEX_COST_QUERY_LOG")
+    if log_path:
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+@st.cache_data(ttl=3600)
+def load_connection_info(_session, account=None):
+    result = _session.sql("SELECT CURRENT_ACCOUNT(), CURRENT_USER(), CURRENT_ROLE()").collect()
+    return result[0].as_dict()
 
 def test_connection(_session):
     try:
-        result = _session.sql("SELECT CURRENT_ACCOUNT(), CURRENT_USER(), CURRENT_ROLE()").collect()
-        return True, result[0].as_dict()
+        return True, load_connection_info(_session)
     except Exception as e:
         return False, str(e)
 
+def session_is_healthy(_session):
+    try:
+        _session.sql("SELECT 1").collect()
+        return True
+    except Exception:
+        return False
+
+def reset_session():
+    stale_session = get_session()
+    get_session.clear()
+    load_connection_info.clear()
+    if not is_running_in_sis():
+        try:
+            stale_session.close()
+        except Exception:
+            pass
+    return get_session()
+
+def account_session_is_stale(connection_name):
+    try:
+        account_session = get_account_session(connection_name)
+    except Exception:
+        # Nothing is cached when the connection cannot be opened, so a reset would not help.
+        return False
+    return not session_is_healthy(account_session)
+
+def reset_account_session(connection_name):
+    # Only this account's pooled session is dropped; the other accounts keep theirs.
+    try:
+        stale_session = get_account_session(connection_name)
+    except Exception:
+        return
+    get_account_session.clear(connection_name)
+    load_connection_info.clear(stale_session, connection_name)
+    try:
+        stale_session.close()
+    except Exception:
+        pass
+
+@st.cache_resource
+def get_usage_store():
+    store_dir = os.getenv("CORTEX_COST_STORE_DIR")
+    if not store_dir:
+        return None
+    return UsageStore(store_dir)
+
+@st.cache_resource
+def get_result_cache():
+    cache_dir = os.getenv("CORTEX_COST_RESULT_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return ResultCache(cache_dir)
+
+def shared_cache(_session, account=None):
+    cache = get_result_cache()
+    if cache is None:
+        return {}
+    info = load_connection_info(_session, account)
+    # The same role name in another account is a different grant, so the account is part of the key.
+    return {'cache': cache, 'role': f"{info.get('CURRENT_ACCOUNT()')}.{info.get('CURRENT_ROLE()')}"}
+
+@st.cache_data(ttl=86400)
+def load_warehouse_dimension(_session, account=None):
+    df = run_sql(_session, warehouse_dimension_query()).to_pandas()
+    return df.set_index('WAREHOUSE_ID')['WAREHOUSE_NAME']
+
+def detail_query(_session, view, start_date, end_date, warehouses=None, models=None, functions=None):
+    if view != 'functions':
+        return USAGE_QUERIES[view](start_date, end_date)
+    warehouse_ids = warehouse_ids_for(load_warehouse_dimension(_session), warehouses)
+    return cortex_functions_usage_query(start_date, end_date, warehouse_ids, models, functions)
+
 @st.cache_data(ttl=300)
-def load_cortex_analyst_usage(_session, start_date, end_date):
-    query = f"""
-    SELECT 
-        START_TIME,
-        END_TIME,
-        USERNAME,
-        CREDITS,
-        REQUEST_COUNT,
-        'Cortex Analyst' as SERVICE_TYPE
-    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_ANALYST_USAGE_HISTORY
-    WHERE START_TIME >= '{start_date}' AND END_TIME <= '{end_date}'
-    ORDER BY START_TIME DESC
-    """
-    return _session.sql(query).to_pandas()
+def count_detail_rows(_session, view, start_date, end_date, column_filters=(), **filters):
+    query = detail_count_query(detail_query(_session, view, start_date, end_date, **filters), column_filters)
+    df = query_frame(_session, query, **shared_cache(_session))
+    return int(df['ROWS'].iloc[0]) if not df.empty else 0
 
 @st.cache_data(ttl=300)
-def load_cortex_functions_usage(_session, start_date, end_date):
-    query = f"""
-    SELECT 
-        f.START_TIME,
-        f.END_TIME,
-        f.FUNCTION_NAME,
-        CASE 
-            WHEN f.MODEL_NAME IS NULL OR TRIM(f.MODEL_NAME) = '' THEN 'internal-models'
-            ELSE f.MODEL_NAME 
-        END as MODEL_NAME,
-        f.WAREHOUSE_ID,
-        w.WAREHOUSE_NAME,
-        f.TOKEN_CREDITS as CREDITS,
-        f.TOKENS,
-        'Cortex Functions' as SERVICE_TYPE
-    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_USAGE_HISTORY f
-    LEFT JOIN (
-        SELECT DISTINCT WAREHOUSE_ID, WAREHOUSE_NAME
-        FROM SNOWFLAKE.ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY
-    ) w ON f.WAREHOUSE_ID = w.WAREHOUSE_ID
-    WHERE f.START_TIME >= '{start_date}' AND f.END_TIME <= '{end_date}'
-    ORDER BY f.START_TIME DESC
-    """
-    return _session.sql(query).to_pandas()
+def load_detail_page(_session, view, start_date, end_date, sort_column, descending, page, column_filters=(), **filters):
+    query = detail_page_query(
+        detail_query(_session, view, start_date, end_date, **filters),
+        sort_column, descending, page, DETAIL_PAGE_SIZE, column_filters, USAGE_KEY_COLUMNS[view]
+    )
+    df = query_frame(_session, query, **shared_cache(_session))
+    if view == 'functions':
+        df = attach_warehouse_names(df, load_warehouse_dimension(_session))
+    return df
+
+def export_batches(view, start_date, end_date, warehouses=None, models=None, functions=None):
+    if view != 'functions':
+        return usage_batches(primary_session(), get_usage_store(), view, USAGE_QUERIES[view], start_date, end_date)
+    warehouse_names = load_warehouse_dimension(primary_session())
+    batches = usage_batches(
+        primary_session(), get_usage_store(), view, cortex_functions_usage_query, start_date, end_date,
+        warehouse_ids=warehouse_ids_for(warehouse_names, warehouses), models=models, functions=functions
+    )
+    return (attach_warehouse_names(df, warehouse_names) for df in batches)
 
 @st.cache_data(ttl=300)
-def load_cortex_search_usage(_session, start_date, end_date):
-    query = f"""
-    SELECT 
-        START_TIME,
-        END_TIME,
-        DATABASE_NAME,
-        SCHEMA_NAME,
-        SERVICE_NAME,
-        SERVICE_ID,
-        CREDITS,
-        'Cortex Search' as SERVICE_TYPE
-    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_SEARCH_SERVING_USAGE_HISTORY
-    WHERE START_TIME >= '{start_date}' AND END_TIME <= '{end_date}'
-    ORDER BY START_TIME DESC
-    """
-    return _session.sql(query).to_pandas()
+def export_to_stage(_session, view, start_date, end_date, export_format, **filters):
+    signature = export_signature(view, start_date, end_date, export_format, filters)
+    query = detail_query(_session, view, start_date, end_date, **filters)
+    run_sql(_session, stage_export_query(query, EXPORT_STAGE, signature, export_format)).collect()
+    return stage_export_location(EXPORT_STAGE, signature)
 
 @st.cache_data(ttl=300)
-def load_cortex_functions_query_usage(_session, start_date, end_date):
-    query = f"""
-    SELECT 
-        q.QUERY_ID,
-        q.WAREHOUSE_ID,
-        w.WAREHOUSE_NAME,
-        CASE 
-            WHEN q.MODEL_NAME IS NULL OR TRIM(q.MODEL_NAME) = '' THEN 'internal-models'
-            ELSE q.MODEL_NAME 
-        END as MODEL_NAME,
-        q.FUNCTION_NAME,
-        q.TOKENS,
-        q.TOKEN_CREDITS as CREDITS,
-        qh.START_TIME,
-        qh.END_TIME,
-        'Cortex Functions Query' as SERVICE_TYPE
-    FROM SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY q
-    LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY qh 
-        ON q.QUERY_ID = qh.QUERY_ID
-    LEFT JOIN (
-        SELECT DISTINCT WAREHOUSE_ID, WAREHOUSE_NAME
-        FROM SNOWFLAKE.ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY
-    ) w ON q.WAREHOUSE_ID = w.WAREHOUSE_ID
-    WHERE qh.START_TIME >= '{start_date}' AND qh.END_TIME <= '{end_date}'
-    ORDER BY qh.START_TIME DESC
-    """
-    return _session.sql(query).to_pandas()
+def rollup_table_coverage(_session, account=None):
+    return table_coverage(_session, ROLLUP_TABLE)
 
-st.title(":material/monitoring: Cortex Cost Monitor")
+@st.cache_data(ttl=300)
+def load_cortex_analyst_rollup(_session, start_date, end_date, granularity='DAY', compare_start=None, account=None):
+    return load_rollup(
+        _session, 'Cortex Analyst', cortex_analyst_rollup_query, start_date, end_date,
+        rollup_table_coverage(_session, account), granularity=granularity, compare_start=compare_start,
+        **shared_cache(_session, account)
+    )
+
+@st.cache_data(ttl=300)
+def load_cortex_functions_rollup(_session, start_date, end_date, granularity='DAY', compare_start=None, account=None):
+    df = load_rollup(
+        _session, 'Cortex Functions', cortex_functions_rollup_query, start_date, end_date,
+        rollup_table_coverage(_session, account), granularity=granularity, compare_start=compare_start,
+        **shared_cache(_session, account)
+    )
+    return attach_warehouse_names(df, load_warehouse_dimension(_session, account))
 
-session = get_session()
+@st.cache_data(ttl=300)
+def load_cortex_search_rollup(_session, start_date, end_date, granularity='DAY', compare_start=None, account=None):
+    return load_rollup(
+        _session, 'Cortex Search', cortex_search_rollup_query, start_date, end_date,
+        rollup_table_coverage(_session, account), granularity=granularity, compare_start=compare_start,
+        **shared_cache(_session, account)
+    )
+
+@st.cache_data(ttl=300)
+def load_cortex_functions_query_rollup(_session, start_date, end_date, granularity='DAY', compare_start=None, account=None):
+    df = load_rollup(
+        _session, 'Cortex Functions Query', cortex_functions_query_rollup_query, start_date, end_date,
+        rollup_table_coverage(_session, account), granularity=granularity, compare_start=compare_start,
+        **shared_cache(_session, account)
+    )
+    return attach_warehouse_names(df, load_warehouse_dimension(_session, account))
 
-is_connected, conn_info = test_connection(session)
+LOADERS = {
+    "Cortex Analyst": load_cortex_analyst_rollup,
+    "Cortex Functions": load_cortex_functions_rollup,
+    "Cortex Functions Query": load_cortex_functions_query_rollup,
+    "Cortex Search": load_cortex_search_rollup,
+}
 
-if not is_connected:
-    st.error(f"Failed to connect to Snowflake: {conn_info}")
-    st.stop()
+SERVICE_LOADERS = {
+    "Cortex Analyst": ["Cortex Analyst"],
+    "Cortex Functions": ["Cortex Functions", "Cortex Functions Query"],
+    "Cortex Search": ["Cortex Search"],
+}
+
+LOADER_THREADS = int(os.getenv("CORTEX_COST_LOADER_THREADS", "4"))
+
+def run_in_scope(name, loader):
+    with loader_scope(name):
+        return loader()
+
+def run_loaders(loaders, on_done):
+    ctx = get_script_run_ctx()
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(
+        max_workers=LOADER_THREADS,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    ) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, run_in_scope, name, loader): name
+            for name, loader in loaders.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                on_done(name, results[name], None)
+            except Exception as e:
+                results[name] = pd.DataFrame()
+                errors[name] = e
+                on_done(name, results[name], e)
+    return results, errors
+
+def show_loader_status(placeholder, name, df, error):
+    df, _ = split_periods(df)
+    if error is not None:
+        placeholder.error(f"{name}: {error}", icon=":material/error:")
+    elif df.empty:
+        placeholder.metric(name, "No data")
+    elif name == "Cortex Functions Query":
+        placeholder.metric(f"{name} Requests", f"{int(df['REQUESTS'].sum()):,}")
+    else:
+        placeholder.metric(f"{name} Credits", f"{df['CREDITS'].sum():.4f}")
+
+def show_detail_grid(view, start_date, end_date, column_config, **filters):
+    sort_columns, filter_columns = DETAIL_COLUMNS[view]
+    col1, col2, col3, col4 = st.columns([2, 1, 2, 2])
+    with col1:
+        sort_column = st.selectbox("Sort by", sort_columns, key=f"{view}_sort")
+    with col2:
+        descending = st.toggle("Descending", value=True, key=f"{view}_descending")
+    with col3:
+        filter_column = st.selectbox("Filter column", filter_columns, key=f"{view}_filter_column")
+    with col4:
+        filter_value = st.text_input("Contains", key=f"{view}_filter_value")
+    column_filters = ((filter_column, filter_value.strip()),) if filter_value.strip() else ()
+
+    with loader_scope(f"Detail {view}"):
+        total_rows = count_detail_rows(primary_session(), view, start_date, end_date, column_filters, **filters)
+    pages = max(math.ceil(total_rows / DETAIL_PAGE_SIZE), 1)
+    if st.session_state.get(f"{view}_page", 1) > pages:
+        st.session_state[f"{view}_page"] = 1
+    page = st.number_input("Page", min_value=1, max_value=pages, key=f"{view}_page") - 1
+
+    with loader_scope(f"Detail {view}"):
+        detail = load_detail_page(primary_session(), view, start_date, end_date, sort_column, descending, page, column_filters, **filters)
+    st.dataframe(detail, hide_index=True, use_container_width=True, column_config=column_config)
+    first_row = page * DETAIL_PAGE_SIZE
+    if total_rows:
+        st.caption(f"Rows {first_row + 1:,}–{first_row + len(detail):,} of {total_rows:,}")
+    else:
+        st.caption("No rows match the current filter")
+
+def show_export(view, file_name, start_date, end_date, **filters):
+    export_format = st.selectbox(
+        "Export format",
+        list(EXPORT_FORMATS),
+        format_func=lambda export_format: EXPORT_FORMATS[export_format][0],
+        key=f"{view}_export_format"
+    )
+    signature = export_signature(view, start_date, end_date, export_format, filters)
+    path = export_path(signature, export_format)
+    use_stage = bool(EXPORT_STAGE) and count_detail_rows(primary_session(), view, start_date, end_date, **filters) > EXPORT_STAGE_ROWS
+    stage_exports = st.session_state.setdefault('stage_exports', {})
+
+    if st.button("Prepare export", key=f"{view}_export"):
+        with st.spinner("Preparing export..."), loader_scope(f"Export {view}"):
+            if use_stage:
+                stage_exports[signature] = export_to_stage(primary_session(), view, start_date, end_date, export_format, **filters)
+            elif not export_is_fresh(path):
+                write_export(export_batches(view, start_date, end_date, **filters), path, export_format)
+
+    if use_stage and signature in stage_exports:
+        st.info(f"Exported to `{stage_exports[signature]}`. Download the files with `GET {stage_exports[signature]} file://<local directory>`.")
+    elif not use_stage and export_is_fresh(path):
+        try:
+            with open(path, 'rb') as f:
+                st.download_button(
+                    f":material/download: Download {EXPORT_FORMATS[export_format][0]}",
+                    f,
+                    f"{file_name}.{export_format}",
+                    EXPORT_FORMATS[export_format][1],
+                    key=f"{view}_download"
+                )
+        except FileNotFoundError:
+            # Pruned by another session after it expired; "Prepare export" writes it again.
+            pass
+
+def diagnostics_enabled():
+    return st.session_state.get("diagnostics", os.getenv("CORTEX_COST_DIAGNOSTICS") == "1")
+
+def show_chart(name, chart):
+    if diagnostics_enabled():
+        record('chart', LOADER=name, ROWS=chart_rows(chart), BYTES=spec_size(chart))
+    st.altair_chart(chart, use_container_width=True)
+
+def metric_delta(current, previous):
+    change = percent_change(current, previous)
+    return None if change is None else f"{change:+.1%} vs previous period"
+
+def show_change_ranking(changes, column, title):
+    st.dataframe(
+        changes,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            column: title,
+            "CREDITS": st.column_config.NumberColumn("Credits", format="%.6f"),
+            "PREVIOUS_CREDITS": st.column_config.NumberColumn("Previous Credits", format="%.6f"),
+            "CHANGE": st.column_config.NumberColumn("Change", format="%+.6f"),
+            "CHANGE_PCT": st.column_config.NumberColumn("Change %", format="percent"),
+        }
+    )
+
+def detect_spikes(frames, key, granularity, window_end, persist=True):
+    # The EWMA state survives reruns, so only buckets after its checkpoint are scored again.
+    states = st.session_state.setdefault('anomaly_states', {})
+    state = states.get(key)
+    if not persist:
+        # A failed loader leaves its series at zero; score this rerun on a copy so
+        # those gaps never become part of the stored baseline.
+        state = copy.deepcopy(state)
+    state, flags = detect_anomalies(credit_series(frames, granularity), state, settled_bucket(window_end))
+    if persist:
+        states[key] = state
+    return flags
+
+st.title(":material/monitoring: Cortex Cost Monitor")
+
+configure_query_log()
+diagnostic_records = start_run()
+
+if multi_account_mode():
+    # Every account, the primary included, is opened by its own loaders, so an
+    # unreachable connection shows up in the Accounts table instead of stopping the page.
+    session = None
+    conn_info = {}
+    now = fixture_clock(primary_connection_name())
+else:
+    session = get_session()
+    
+    is_connected, conn_info = test_connection(session)
+    # Only probe the session when something failed; a dead session (expired
+    # token, dropped connection) is replaced once and the check retried.
+    if not is_connected and not session_is_healthy(session):
+        session = reset_session()
+        is_connected, conn_info = test_connection(session)
+    
+    if not is_connected:
+        st.error(f"Failed to connect to Snowflake: {conn_info}")
+        st.stop()
+    
+    now = session_clock(session)
 
 with st.sidebar:
     st.header("Filters")
@@ -153,20 +453,20 @@ with st.sidebar:
     )
     
     if date_preset == "Last 7 Days":
-        start_date = datetime.now() - timedelta(days=7)
-        end_date = datetime.now()
+        start_date = now - timedelta(days=7)
+        end_date = now
     elif date_preset == "Last 30 Days":
-        start_date = datetime.now() - timedelta(days=30)
-        end_date = datetime.now()
+        start_date = now - timedelta(days=30)
+        end_date = now
     elif date_preset == "Last 90 Days":
-        start_date = datetime.now() - timedelta(days=90)
-        end_date = datetime.now()
+        start_date = now - timedelta(days=90)
+        end_date = now
     else:
         col1, col2 = st.columns(2)
         with col1:
-            start_date = st.date_input("Start Date", datetime.now() - timedelta(days=30))
+            start_date = st.date_input("Start Date", now - timedelta(days=30))
         with col2:
-            end_date = st.date_input("End Date", datetime.now())
+            end_date = st.date_input("End Date", now)
         start_date = datetime.combine(start_date, datetime.min.time())
         end_date = datetime.combine(end_date, datetime.max.time())
     
@@ -177,6 +477,12 @@ with st.sidebar:
         ["Cortex Analyst", "Cortex Functions", "Cortex Search"],
         default=["Cortex Analyst", "Cortex Functions", "Cortex Search"]
     )
+    
+    compare_periods = st.toggle(
+        "Compare with previous period",
+        value=os.getenv("CORTEX_COST_COMPARE") == "1",
+        help="Fetches the preceding window of the same length in the same query and shows the change in the KPI tiles."
+    )
 
 with st.spinner("Loading data..."):
     df_analyst = pd.DataFrame()
@@ -184,26 +490,94 @@ with st.spinner("Loading data..."):
     df_search = pd.DataFrame()
     df_query_functions = pd.DataFrame()
     
-    if "Cortex Analyst" in service_types:
-        df_analyst = load_cortex_analyst_usage(session, start_date, end_date)
+    window_start, window_end = snap_window(start_date, end_date)
+    granularity = choose_granularity(window_start, window_end)
+    compare_start = comparison_start(window_start, window_end) if compare_periods else None
+    
+    loader_names = [name for service_type in service_types for name in SERVICE_LOADERS[service_type]]
+    account_status = None
+    if multi_account_mode():
+        # One loader per account and service; each opens (or reuses) its account's pooled session on a worker thread.
+        targets = {f"{name} · {account}": (name, account) for account in CONNECTION_NAMES for name in loader_names}
+        loaders = {
+            key: lambda name=name, account=account: LOADERS[name](
+                get_account_session(account), window_start, window_end, granularity, compare_start, account
+            )
+            for key, (name, account) in targets.items()
+        }
+    else:
+        loaders = {
+            name: lambda name=name: LOADERS[name](session, window_start, window_end, granularity, compare_start)
+            for name in loader_names
+        }
     
-    if "Cortex Functions" in service_types:
-        df_functions = load_cortex_functions_usage(session, start_date, end_date)
-        df_query_functions = load_cortex_functions_query_usage(session, start_date, end_date)
+    results = {}
+    errors = {}
+    if loaders and multi_account_mode():
+        results, errors = run_loaders(loaders, lambda name, df, error: None)
+        account_frames = {account: {} for account in CONNECTION_NAMES}
+        account_errors = {}
+        for key, (name, account) in targets.items():
+            account_frames[account][name] = results[key]
+            if key in errors:
+                account_errors.setdefault(account, {})[name] = errors[key]
+        if account_errors and not st.session_state.get('session_reset'):
+            stale_accounts = [account for account in account_errors if account_session_is_stale(account)]
+            if stale_accounts:
+                st.session_state['session_reset'] = True
+                for account in stale_accounts:
+                    reset_account_session(account)
+                st.rerun()
+        st.session_state['session_reset'] = False
+        # A failed account only drops its own rows; the others are still merged and shown.
+        account_status = account_freshness(account_frames, account_errors)
+        results = {
+            name: merge_accounts({account: frames[name] for account, frames in account_frames.items()})
+            for name in loader_names
+        }
+    elif loaders:
+        status_placeholders = dict(zip(loaders, (col.empty() for col in st.columns(len(loaders)))))
+        results, errors = run_loaders(
+            loaders,
+            lambda name, df, error: show_loader_status(status_placeholders[name], name, df, error)
+        )
+        if errors and not st.session_state.get('session_reset') and not session_is_healthy(session):
+            st.session_state['session_reset'] = True
+            reset_session()
+            st.rerun()
+        st.session_state['session_reset'] = False
+    df_analyst = results.get("Cortex Analyst", df_analyst)
+    df_functions = results.get("Cortex Functions", df_functions)
+    df_query_functions = results.get("Cortex Functions Query", df_query_functions)
+    df_search = results.get("Cortex Search", df_search)
     
-    if "Cortex Search" in service_types:
-        df_search = load_cortex_search_usage(session, start_date, end_date)
+    df_analyst, previous_analyst = split_periods(df_analyst)
+    df_functions, previous_functions = split_periods(df_functions)
+    df_query_functions, previous_query_functions = split_periods(df_query_functions)
+    df_search, previous_search = split_periods(df_search)
 
-all_data = []
-if not df_analyst.empty:
-    all_data.append(df_analyst[['START_TIME', 'CREDITS', 'SERVICE_TYPE']])
-if not df_functions.empty:
-    all_data.append(df_functions[['START_TIME', 'CREDITS', 'SERVICE_TYPE']])
-if not df_search.empty:
-    all_data.append(df_search[['START_TIME', 'CREDITS', 'SERVICE_TYPE']])
+if account_status is not None:
+    failed_accounts = account_status.loc[account_status['STATUS'] != 'OK', 'ACCOUNT'].tolist()
+    if failed_accounts:
+        st.warning(f"Some usage could not be loaded from: {', '.join(failed_accounts)}. Totals cover the remaining accounts.")
+    with st.expander(":material/hub: Accounts", expanded=bool(failed_accounts)):
+        st.dataframe(
+            account_status,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "ACCOUNT": "Connection",
+                "STATUS": "Status",
+                "LOADED_AT": st.column_config.DatetimeColumn("Loaded At", format="YYYY-MM-DD HH:mm:ss"),
+                "LATEST_USAGE": st.column_config.DatetimeColumn("Latest Usage", format="YYYY-MM-DD HH:mm"),
+                "ERRORS": "Errors",
+            }
+        )
 
-if all_data:
-    combined_df = pd.concat(all_data, ignore_index=True)
+if not (df_analyst.empty and df_functions.empty and df_search.empty):
+    selected_warehouses = []
+    selected_models = []
+    selected_functions = []
     
     with st.sidebar:
         if not df_functions.empty:
@@ -238,43 +612,58 @@ if all_data:
                 selected_functions = []
     
     if not df_functions.empty:
-        if selected_warehouses:
-            df_functions = df_functions[df_functions['WAREHOUSE_NAME'].isin(selected_warehouses)]
-        if selected_models:
-            df_functions = df_functions[df_functions['MODEL_NAME'].isin(selected_models)]
-        if selected_functions:
-            df_functions = df_functions[df_functions['FUNCTION_NAME'].isin(selected_functions)]
+        function_filters = {
+            'warehouses': active_filter(selected_warehouses, available_warehouses),
+            'models': active_filter(selected_models, available_models),
+            'functions': active_filter(selected_functions, available_functions),
+        }
+    else:
+        function_filters = {}
+    filter_masks = st.session_state.setdefault('filter_masks', {})
+    df_functions = apply_function_filters(df_functions, filter_masks, **function_filters)
+    df_query_functions = apply_function_filters(df_query_functions, filter_masks, **function_filters)
+    
+    combined_df = combine_service_credits([df_analyst, df_functions, df_search])
     
     total_credits = combined_df['CREDITS'].sum()
-    total_requests = 0
-    if not df_analyst.empty:
-        total_requests += df_analyst['REQUEST_COUNT'].sum()
-    if not df_query_functions.empty:
-        total_requests += len(df_query_functions)
+    total_requests = count_requests(df_analyst, df_query_functions)
     
     avg_cost_per_request = total_credits / total_requests if total_requests > 0 else 0
     
+    previous_credits = previous_requests = previous_avg_cost = previous_tokens = previous_credits_per_1m = None
+    if compare_periods:
+        previous_functions = apply_function_filters(previous_functions, filter_masks, **function_filters)
+        previous_query_functions = apply_function_filters(previous_query_functions, filter_masks, **function_filters)
+        previous_credits = combine_service_credits([previous_analyst, previous_functions, previous_search])['CREDITS'].sum()
+        previous_requests = count_requests(previous_analyst, previous_query_functions)
+        previous_avg_cost = previous_credits / previous_requests if previous_requests > 0 else 0
+        if 'TOKENS' in previous_functions.columns:
+            previous_tokens = int(previous_functions['TOKENS'].sum())
+            previous_credits_per_1m = (previous_credits / previous_tokens * 1_000_000) if previous_tokens > 0 else 0
+    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric(
             "💳 Total Credits",
             f"{total_credits:.4f}",
-            delta=None
+            delta=metric_delta(total_credits, previous_credits),
+            delta_color="inverse"
         )
     
     with col2:
         st.metric(
             "📊 Total Requests",
             f"{int(total_requests):,}",
-            delta=None
+            delta=metric_delta(total_requests, previous_requests)
         )
     
     with col3:
         st.metric(
             "💰 Avg Cost/Request",
             f"{avg_cost_per_request:.6f}",
-            delta=None
+            delta=metric_delta(avg_cost_per_request, previous_avg_cost),
+            delta_color="inverse"
         )
     
     with col4:
@@ -286,15 +675,10 @@ if all_data:
         )
     
     if not df_functions.empty and 'TOKENS' in df_functions.columns:
-        total_tokens = df_functions['TOKENS'].sum()
+        total_tokens = int(df_functions['TOKENS'].sum())
         avg_credits_per_1m_tokens = (total_credits / total_tokens * 1_000_000) if total_tokens > 0 else 0
         
-        model_efficiency = df_functions.groupby('MODEL_NAME').agg({
-            'TOKENS': 'sum',
-            'CREDITS': 'sum'
-        }).reset_index()
-        model_efficiency['CREDITS_PER_1M_TOKENS'] = (model_efficiency['CREDITS'] / model_efficiency['TOKENS']) * 1_000_000
-        model_efficiency = model_efficiency.sort_values('CREDITS_PER_1M_TOKENS')
+        model_efficiency = token_efficiency(df_functions, 'MODEL_NAME').sort_values('CREDITS_PER_1M_TOKENS')
         
         col1, col2 = st.columns(2)
         
@@ -302,196 +686,159 @@ if all_data:
             st.metric(
                 "🎫 Total Tokens",
                 f"{int(total_tokens):,}",
-                delta=None
+                delta=metric_delta(total_tokens, previous_tokens)
             )
         
         with col2:
             st.metric(
                 "⚡ Avg Credits/1M Tokens",
                 f"{avg_credits_per_1m_tokens:.2f}",
-                delta=None
+                delta=metric_delta(avg_credits_per_1m_tokens, previous_credits_per_1m),
+                delta_color="inverse"
             )
     
     st.divider()
     
+    # Each breakdown is aggregated and capped once, then shared by every chart that plots it.
+    if not df_functions.empty:
+        model_summary = token_efficiency(df_functions, 'MODEL_NAME', limit=CHART_CATEGORY_LIMIT)
+        function_summary = token_efficiency(df_functions, 'FUNCTION_NAME', limit=CHART_CATEGORY_LIMIT)
+        warehouse_summary = credits_by(df_functions, 'WAREHOUSE_NAME', limit=CHART_CATEGORY_LIMIT).reset_index()
+    
+    # Spikes are scored on the uncapped series so a model folded into "Other" still gets flagged.
+    anomaly_frames = {'Service': (combined_df, 'SERVICE_TYPE')}
+    if not df_functions.empty:
+        anomaly_frames['Model'] = (df_functions, 'MODEL_NAME')
+        anomaly_frames['Warehouse'] = (df_functions, 'WAREHOUSE_NAME')
+    if 'ACCOUNT' in combined_df.columns:
+        anomaly_frames['Account'] = (combined_df, 'ACCOUNT')
+    anomalies = detect_spikes(
+        anomaly_frames,
+        (granularity, tuple(service_types), filter_signature(df_functions, function_filters)[1]),
+        granularity, window_end, persist=not errors
+    )
+    
     tab1, tab2, tab3 = st.tabs(["Consumption over Time", "Consumption Breakdown", "Token Economy"])
     
     with tab1:
         st.subheader(":material/show_chart: Credits Over Time")
         
-        time_series_data = combined_df.copy()
-        time_series_data['DATE'] = pd.to_datetime(time_series_data['START_TIME']).dt.date
-        daily_credits = time_series_data.groupby(['DATE', 'SERVICE_TYPE'])['CREDITS'].sum().reset_index()
-        
-        chart = alt.Chart(daily_credits).mark_area().encode(
-            x=alt.X('DATE:T', title='Date'),
-            y=alt.Y('CREDITS:Q', title='Credits', stack='zero'),
-            color=alt.Color('SERVICE_TYPE:N', title='Service Type'),
-            tooltip=[
-                alt.Tooltip('DATE:T', format='%Y-%m-%d'),
-                'SERVICE_TYPE:N',
-                alt.Tooltip('CREDITS:Q', format='.6f')
-            ]
-        ).properties(height=400)
-        st.altair_chart(chart, use_container_width=True)
+        daily_credits = daily_breakdown(combined_df, 'SERVICE_TYPE')
+        show_chart("Credits Over Time", with_anomalies(
+            time_area_chart(daily_credits, 'SERVICE_TYPE', 'CREDITS', 'Service Type', 'Credits', granularity),
+            anomalies[anomalies['DIMENSION'] == 'Service'], 'SERVICE_TYPE', 'Service Type', granularity
+        ))
         
         if not df_functions.empty and 'WAREHOUSE_NAME' in df_functions.columns:
             st.subheader(":material/warehouse: Credits Over Time Per Warehouse")
-            time_series_warehouse = df_functions.copy()
-            time_series_warehouse['DATE'] = pd.to_datetime(time_series_warehouse['START_TIME']).dt.date
-            daily_credits_by_warehouse = time_series_warehouse.groupby(['DATE', 'WAREHOUSE_NAME'])['CREDITS'].sum().reset_index()
+            daily_credits_by_warehouse = daily_breakdown(df_functions, 'WAREHOUSE_NAME')
             daily_credits_by_warehouse = daily_credits_by_warehouse[daily_credits_by_warehouse['WAREHOUSE_NAME'].notna()]
-            
-            chart = alt.Chart(daily_credits_by_warehouse).mark_area().encode(
-                x=alt.X('DATE:T', title='Date'),
-                y=alt.Y('CREDITS:Q', title='Credits', stack='zero'),
-                color=alt.Color('WAREHOUSE_NAME:N', title='Warehouse'),
-                tooltip=[
-                    alt.Tooltip('DATE:T', format='%Y-%m-%d'),
-                    'WAREHOUSE_NAME:N',
-                    alt.Tooltip('CREDITS:Q', format='.6f')
-                ]
-            ).properties(height=400)
-            st.altair_chart(chart, use_container_width=True)
+            show_chart("Credits Over Time Per Warehouse", with_anomalies(
+                time_area_chart(daily_credits_by_warehouse, 'WAREHOUSE_NAME', 'CREDITS', 'Warehouse', 'Credits', granularity),
+                anomalies[anomalies['DIMENSION'] == 'Warehouse'], 'WAREHOUSE_NAME', 'Warehouse', granularity
+            ))
         
         if not df_functions.empty and 'TOKENS' in df_functions.columns:
             st.subheader(":material/trending_up: Token Consumption Over Time")
-            time_series_tokens = df_functions.copy()
-            time_series_tokens['DATE'] = pd.to_datetime(time_series_tokens['START_TIME']).dt.date
-            daily_tokens_by_model = time_series_tokens.groupby(['DATE', 'MODEL_NAME'])['TOKENS'].sum().reset_index()
-            
-            chart = alt.Chart(daily_tokens_by_model).mark_area().encode(
-                x=alt.X('DATE:T', title='Date'),
-                y=alt.Y('TOKENS:Q', title='Tokens', stack='zero'),
-                color=alt.Color('MODEL_NAME:N', title='Model'),
-                tooltip=[
-                    alt.Tooltip('DATE:T', format='%Y-%m-%d'),
-                    'MODEL_NAME:N',
-                    alt.Tooltip('TOKENS:Q', format=',')
-                ]
-            ).properties(height=300)
-            st.altair_chart(chart, use_container_width=True)
+            daily_tokens_by_model = daily_breakdown(df_functions, 'MODEL_NAME', 'TOKENS')
+            show_chart("Token Consumption Over Time", with_anomalies(
+                time_area_chart(
+                    daily_tokens_by_model, 'MODEL_NAME', 'TOKENS', 'Model', 'Tokens', granularity,
+                    measure_format=',', height=300
+                ),
+                anomalies[anomalies['DIMENSION'] == 'Model'], 'MODEL_NAME', 'Model', granularity
+            ))
+        
+        st.subheader(":material/warning: Credit Spikes")
+        if anomalies.empty:
+            st.info("No credit spikes detected in this window.")
+        else:
+            st.dataframe(
+                anomalies.sort_values(['DATE', 'ZSCORE'], ascending=False),
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    "DATE": st.column_config.DatetimeColumn("Date", format="YYYY-MM-DD HH:mm" if granularity == 'HOUR' else "YYYY-MM-DD"),
+                    "DIMENSION": "Dimension",
+                    "SERIES": "Series",
+                    "CREDITS": st.column_config.NumberColumn("Credits", format="%.6f"),
+                    "BASELINE": st.column_config.NumberColumn("Baseline", format="%.6f"),
+                    "ZSCORE": st.column_config.NumberColumn("Z-score", format="%.1f"),
+                }
+            )
     
     with tab2:
         col1, col2 = st.columns(2)
         
         with col1:
             st.subheader(":material/memory: By Model")
-            if not df_functions.empty and 'MODEL_NAME' in df_functions.columns:
-                model_costs = df_functions.groupby('MODEL_NAME')['CREDITS'].sum().sort_values(ascending=False).head(10)
-                if not model_costs.empty:
-                    model_df = pd.DataFrame(model_costs).reset_index()
-                    model_df = model_df.sort_values('CREDITS', ascending=False)
-                    chart = alt.Chart(model_df).mark_bar().encode(
-                        x=alt.X('CREDITS:Q', title='Credits'),
-                        y=alt.Y('MODEL_NAME:N', sort='-x', title='Model'),
-                        tooltip=['MODEL_NAME', 'CREDITS']
-                    ).properties(height=300)
-                    st.altair_chart(chart, use_container_width=True)
-                else:
-                    st.info("No model data available")
+            if not df_functions.empty and not model_summary.empty:
+                show_chart("By Model", bar_chart(model_summary, 'MODEL_NAME', 'CREDITS', 'Model', 'Credits'))
             else:
                 st.info("No model data available")
         
         with col2:
             st.subheader(":material/functions: By Function")
-            if not df_functions.empty and 'FUNCTION_NAME' in df_functions.columns:
-                function_costs = df_functions.groupby('FUNCTION_NAME')['CREDITS'].sum().sort_values(ascending=False).head(10)
-                if not function_costs.empty:
-                    function_df = pd.DataFrame(function_costs).reset_index()
-                    function_df = function_df.sort_values('CREDITS', ascending=False)
-                    chart = alt.Chart(function_df).mark_bar().encode(
-                        x=alt.X('CREDITS:Q', title='Credits'),
-                        y=alt.Y('FUNCTION_NAME:N', sort='-x', title='Function'),
-                        tooltip=['FUNCTION_NAME', 'CREDITS']
-                    ).properties(height=300)
-                    st.altair_chart(chart, use_container_width=True)
-                else:
-                    st.info("No function data available")
+            if not df_functions.empty and not function_summary.empty:
+                show_chart("By Function", bar_chart(function_summary, 'FUNCTION_NAME', 'CREDITS', 'Function', 'Credits'))
             else:
                 st.info("No function data available")
         
         st.subheader(":material/warehouse: By Warehouse")
-        if not df_functions.empty and 'WAREHOUSE_NAME' in df_functions.columns:
-            warehouse_costs = df_functions.groupby('WAREHOUSE_NAME')['CREDITS'].sum().sort_values(ascending=False)
-            if not warehouse_costs.empty:
-                warehouse_df = pd.DataFrame(warehouse_costs).reset_index()
-                warehouse_df = warehouse_df.sort_values('CREDITS', ascending=False)
-                chart = alt.Chart(warehouse_df).mark_bar().encode(
-                    x=alt.X('CREDITS:Q', title='Credits'),
-                    y=alt.Y('WAREHOUSE_NAME:N', sort='-x', title='Warehouse'),
-                    tooltip=['WAREHOUSE_NAME', 'CREDITS']
-                ).properties(height=300)
-                st.altair_chart(chart, use_container_width=True)
-            else:
-                st.info("No warehouse data available")
+        if not df_functions.empty and not warehouse_summary.empty:
+            show_chart("By Warehouse", bar_chart(warehouse_summary, 'WAREHOUSE_NAME', 'CREDITS', 'Warehouse', 'Credits'))
         else:
             st.info("No warehouse data available")
+        
+        if 'ACCOUNT' in combined_df.columns:
+            st.subheader(":material/hub: By Account")
+            account_summary = credits_by(combined_df, 'ACCOUNT').reset_index()
+            show_chart("By Account", bar_chart(account_summary, 'ACCOUNT', 'CREDITS', 'Account', 'Credits'))
+        
+        if compare_periods and not df_functions.empty:
+            st.subheader(":material/compare_arrows: Change vs Previous Period")
+            col1, col2 = st.columns(2)
+            with col1:
+                show_change_ranking(period_changes(df_functions, previous_functions, 'MODEL_NAME'), 'MODEL_NAME', "Model")
+            with col2:
+                show_change_ranking(period_changes(df_functions, previous_functions, 'WAREHOUSE_NAME'), 'WAREHOUSE_NAME', "Warehouse")
     
     with tab3:
         if not df_functions.empty and 'TOKENS' in df_functions.columns:
-            function_tokens = df_functions.groupby('FUNCTION_NAME').agg({
-                'TOKENS': 'sum',
-                'CREDITS': 'sum'
-            }).reset_index()
-            function_tokens['CREDITS_PER_1M_TOKENS'] = (function_tokens['CREDITS'] / function_tokens['TOKENS']) * 1_000_000
-            function_tokens = function_tokens.sort_values('TOKENS', ascending=False)
+            token_tooltip = (
+                alt.Tooltip('TOKENS:Q', format=','),
+                alt.Tooltip('CREDITS:Q', format='.6f'),
+                alt.Tooltip('CREDITS_PER_1M_TOKENS:Q', format='.2f')
+            )
             
             col1, col2 = st.columns(2)
             
             with col1:
                 st.subheader(":material/bar_chart: Tokens by Model")
-                if not model_efficiency.empty:
-                    model_tokens_df = model_efficiency.sort_values('TOKENS', ascending=False).head(10)
-                    chart = alt.Chart(model_tokens_df).mark_bar().encode(
-                        x=alt.X('TOKENS:Q', title='Total Tokens'),
-                        y=alt.Y('MODEL_NAME:N', sort='-x', title='Model'),
-                        color=alt.Color('CREDITS_PER_1M_TOKENS:Q', 
-                                      scale=alt.Scale(scheme='redyellowgreen', reverse=True),
-                                      title='Credits/1M Tokens'),
-                        tooltip=['MODEL_NAME', 
-                                alt.Tooltip('TOKENS:Q', format=','),
-                                alt.Tooltip('CREDITS:Q', format='.6f'),
-                                alt.Tooltip('CREDITS_PER_1M_TOKENS:Q', format='.2f')]
-                    ).properties(height=300)
-                    st.altair_chart(chart, use_container_width=True)
+                if not model_summary.empty:
+                    show_chart("Tokens by Model", bar_chart(
+                        model_summary, 'MODEL_NAME', 'TOKENS', 'Model', 'Total Tokens',
+                        color=efficiency_color(), tooltip=token_tooltip
+                    ))
                 else:
                     st.info("No token data available")
             
             with col2:
                 st.subheader(":material/functions: Tokens by Function")
-                if not function_tokens.empty:
-                    function_tokens_chart = function_tokens.sort_values('TOKENS', ascending=False)
-                    chart = alt.Chart(function_tokens_chart).mark_bar().encode(
-                        x=alt.X('TOKENS:Q', title='Total Tokens'),
-                        y=alt.Y('FUNCTION_NAME:N', sort='-x', title='Function'),
-                        color=alt.Color('CREDITS_PER_1M_TOKENS:Q', 
-                                      scale=alt.Scale(scheme='redyellowgreen', reverse=True),
-                                      title='Credits/1M Tokens'),
-                        tooltip=['FUNCTION_NAME', 
-                                alt.Tooltip('TOKENS:Q', format=','),
-                                alt.Tooltip('CREDITS:Q', format='.6f'),
-                                alt.Tooltip('CREDITS_PER_1M_TOKENS:Q', format='.2f')]
-                    ).properties(height=300)
-                    st.altair_chart(chart, use_container_width=True)
+                if not function_summary.empty:
+                    show_chart("Tokens by Function", bar_chart(
+                        function_summary, 'FUNCTION_NAME', 'TOKENS', 'Function', 'Total Tokens',
+                        color=efficiency_color(), tooltip=token_tooltip
+                    ))
                 else:
                     st.info("No function token data available")
             
             st.subheader(":material/efficiency: Credits per 1M Tokens Efficiency")
-            if not model_efficiency.empty:
-                efficiency_df = model_efficiency.sort_values('CREDITS_PER_1M_TOKENS', ascending=False).head(10)
-                chart = alt.Chart(efficiency_df).mark_bar().encode(
-                    x=alt.X('CREDITS_PER_1M_TOKENS:Q', title='Credits per 1M Tokens'),
-                    y=alt.Y('MODEL_NAME:N', sort='-x', title='Model'),
-                    color=alt.Color('CREDITS_PER_1M_TOKENS:Q',
-                                  scale=alt.Scale(scheme='redyellowgreen', reverse=True),
-                                  legend=None),
-                    tooltip=['MODEL_NAME', 
-                            alt.Tooltip('CREDITS_PER_1M_TOKENS:Q', format='.2f'),
-                            alt.Tooltip('TOKENS:Q', format=','),
-                            alt.Tooltip('CREDITS:Q', format='.6f')]
-                ).properties(height=300)
-                st.altair_chart(chart, use_container_width=True)
+            if not model_summary.empty:
+                show_chart("Credits per 1M Tokens Efficiency", bar_chart(
+                    model_summary, 'MODEL_NAME', 'CREDITS_PER_1M_TOKENS', 'Model', 'Credits per 1M Tokens',
+                    color=efficiency_color(legend=False), tooltip=token_tooltip
+                ))
             else:
                 st.info("No efficiency data available")
             
@@ -519,84 +866,156 @@ if all_data:
     st.divider()
     
     st.subheader(":material/table: Detailed Data")
+    if multi_account_mode():
+        st.caption(
+            f"Detailed rows and exports come from the primary connection **{primary_connection_name()}** only. "
+            f"The totals above cover all {len(CONNECTION_NAMES)} connections."
+        )
     
-    tab1, tab2, tab3 = st.tabs(["Cortex Analyst", "Cortex Functions", "Cortex Search"])
+    detail_error = primary_connection_error()
+    if detail_error:
+        st.warning(f"{detail_error}. Detailed rows and exports are unavailable.")
+    else:
+        tab1, tab2, tab3 = st.tabs(["Cortex Analyst", "Cortex Functions", "Cortex Search"])
     
-    with tab1:
-        if not df_analyst.empty:
-            st.dataframe(
-                df_analyst,
-                hide_index=True,
-                use_container_width=True,
-                column_config={
-                    "START_TIME": st.column_config.DatetimeColumn("Start Time", format="DD/MM/YYYY HH:mm"),
-                    "END_TIME": st.column_config.DatetimeColumn("End Time", format="DD/MM/YYYY HH:mm"),
-                    "CREDITS": st.column_config.NumberColumn("Credits", format="%.6f"),
-                    "REQUEST_COUNT": st.column_config.NumberColumn("Requests", format="%d")
-                }
-            )
+        with tab1:
+            if not df_analyst.empty:
+                if st.toggle("Load detailed rows", key="detail_analyst"):
+                    show_detail_grid(
+                        'analyst', window_start, window_end,
+                        {
+                            "START_TIME": st.column_config.DatetimeColumn("Start Time", format="DD/MM/YYYY HH:mm"),
+                            "END_TIME": st.column_config.DatetimeColumn("End Time", format="DD/MM/YYYY HH:mm"),
+                            "CREDITS": st.column_config.NumberColumn("Credits", format="%.6f"),
+                            "REQUEST_COUNT": st.column_config.NumberColumn("Requests", format="%d")
+                        }
+                    )
             
-            csv = df_analyst.to_csv(index=False)
-            st.download_button(
-                ":material/download: Download CSV",
-                csv,
-                "cortex_analyst_usage.csv",
-                "text/csv"
-            )
-        else:
-            st.info("No Cortex Analyst data available for selected filters")
+                    show_export('analyst', "cortex_analyst_usage", window_start, window_end)
+            else:
+                st.info("No Cortex Analyst data available for selected filters")
     
-    with tab2:
-        if not df_functions.empty:
-            st.dataframe(
-                df_functions,
-                hide_index=True,
-                use_container_width=True,
-                column_config={
-                    "START_TIME": st.column_config.DatetimeColumn("Start Time", format="DD/MM/YYYY HH:mm"),
-                    "END_TIME": st.column_config.DatetimeColumn("End Time", format="DD/MM/YYYY HH:mm"),
-                    "CREDITS": st.column_config.NumberColumn("Credits", format="%.6f"),
-                    "TOKENS": st.column_config.NumberColumn("Tokens", format="%d")
-                }
-            )
+        with tab2:
+            if not df_functions.empty:
+                if st.toggle("Load detailed rows", key="detail_functions"):
+                    show_detail_grid(
+                        'functions', window_start, window_end,
+                        {
+                            "START_TIME": st.column_config.DatetimeColumn("Start Time", format="DD/MM/YYYY HH:mm"),
+                            "END_TIME": st.column_config.DatetimeColumn("End Time", format="DD/MM/YYYY HH:mm"),
+                            "CREDITS": st.column_config.NumberColumn("Credits", format="%.6f"),
+                            "TOKENS": st.column_config.NumberColumn("Tokens", format="%d")
+                        },
+                        **function_filters
+                    )
             
-            csv = df_functions.to_csv(index=False)
-            st.download_button(
-                ":material/download: Download CSV",
-                csv,
-                "cortex_functions_usage.csv",
-                "text/csv"
-            )
-        else:
-            st.info("No Cortex Functions data available for selected filters")
+                    show_export('functions', "cortex_functions_usage", window_start, window_end, **function_filters)
+            else:
+                st.info("No Cortex Functions data available for selected filters")
     
-    with tab3:
-        if not df_search.empty:
+        with tab3:
+            if not df_search.empty:
+                if st.toggle("Load detailed rows", key="detail_search"):
+                    show_detail_grid(
+                        'search', window_start, window_end,
+                        {
+                            "START_TIME": st.column_config.DatetimeColumn("Start Time", format="DD/MM/YYYY HH:mm"),
+                            "END_TIME": st.column_config.DatetimeColumn("End Time", format="DD/MM/YYYY HH:mm"),
+                            "CREDITS": st.column_config.NumberColumn("Credits", format="%.9f")
+                        }
+                    )
+            
+                    show_export('search', "cortex_search_usage", window_start, window_end)
+            else:
+                st.info("No Cortex Search data available for selected filters")
+
+else:
+    st.warning("No data available for the selected date range and service types")
+
+with st.sidebar:
+    st.divider()
+    loaded_frames = {
+        name: df for name, df in [
+            ("Cortex Analyst", df_analyst),
+            ("Cortex Functions", df_functions),
+            ("Cortex Functions Query", df_query_functions),
+            ("Cortex Search", df_search),
+        ] if not df.empty
+    }
+    if loaded_frames:
+        with st.expander("Memory usage"):
             st.dataframe(
-                df_search,
+                frame_memory(loaded_frames),
                 hide_index=True,
                 use_container_width=True,
                 column_config={
-                    "START_TIME": st.column_config.DatetimeColumn("Start Time", format="DD/MM/YYYY HH:mm"),
-                    "END_TIME": st.column_config.DatetimeColumn("End Time", format="DD/MM/YYYY HH:mm"),
-                    "CREDITS": st.column_config.NumberColumn("Credits", format="%.9f")
+                    "FRAME": st.column_config.TextColumn("Frame"),
+                    "ROWS": st.column_config.NumberColumn("Rows", format="%d"),
+                    "MEMORY_MB": st.column_config.NumberColumn("Memory (MB)", format="%.3f")
                 }
             )
-            
-            csv = df_search.to_csv(index=False)
-            st.download_button(
-                ":material/download: Download CSV",
-                csv,
-                "cortex_search_usage.csv",
-                "text/csv"
-            )
-        else:
-            st.info("No Cortex Search data available for selected filters")
-
-else:
-    st.warning("No data available for the selected date range and service types")
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        with st.expander("Result cache"):
+            cache_metrics = result_cache.metrics()
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Hits", f"{cache_metrics['hits']:,}")
+                st.metric("Entries", f"{cache_metrics['entries']:,}")
+            with col2:
+                st.metric("Misses", f"{cache_metrics['misses']:,}")
+                st.metric("Size (MB)", f"{cache_metrics['size_mb']:.1f}")
+            if cache_metrics['hit_rate'] is not None:
+                st.caption(f"Hit rate: {cache_metrics['hit_rate']:.0%} · Evictions: {cache_metrics['evictions']:,}")
+    with st.expander("Query plan check"):
+        st.caption("Compare bytes scanned by the Cortex Functions query usage join before and after QUERY_HISTORY pruning.")
+        if st.button("Compare plans"):
+            window_start, window_end = snap_window(start_date, end_date)
+            plan_error = primary_connection_error()
+            if plan_error:
+                st.error(plan_error)
+            else:
+                st.dataframe(
+                    compare_query_history_plans(primary_session(), window_start, window_end),
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        "PLAN": st.column_config.TextColumn("Plan"),
+                        "PARTITIONS_TOTAL": st.column_config.NumberColumn("Partitions Total", format="%d"),
+                        "PARTITIONS_ASSIGNED": st.column_config.NumberColumn("Partitions Scanned", format="%d"),
+                        "BYTES_ASSIGNED": st.column_config.NumberColumn("Bytes Scanned", format="%d")
+                    }
+                )
+    show_diagnostics = st.toggle(
+        "Diagnostics",
+        value=diagnostics_enabled(),
+        key="diagnostics"
+    )
+    if multi_account_mode():
+        st.caption(f"Connections: {', '.join(CONNECTION_NAMES)}")
+    else:
+        st.caption(f"Connected as: {conn_info.get('CURRENT_USER()', 'Unknown')}")
+        st.caption(f"Role: {conn_info.get('CURRENT_ROLE()', 'Unknown')}")
 
-with st.sidebar:
+if show_diagnostics:
     st.divider()
-    st.caption(f"Connected as: {conn_info.get('CURRENT_USER()', 'Unknown')}")
-    st.caption(f"Role: {conn_info.get('CURRENT_ROLE()', 'Unknown')}")
+    st.subheader(":material/speed: Diagnostics")
+    st.caption("Loader calls and Snowflake queries issued by this rerun. A loader with cache \"hit\" was served by st.cache_data without querying.")
+    st.dataframe(
+        pd.DataFrame(
+            diagnostic_records,
+            columns=['EVENT', 'LOADER', 'CACHE', 'SECONDS', 'POST_SECONDS', 'ROWS', 'BYTES', 'QUERY_ID']
+        ),
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "EVENT": st.column_config.TextColumn("Event"),
+            "LOADER": st.column_config.TextColumn("Loader"),
+            "CACHE": st.column_config.TextColumn("Cache"),
+            "SECONDS": st.column_config.NumberColumn("Wall Time (s)", format="%.3f"),
+            "POST_SECONDS": st.column_config.NumberColumn("Pandas Time (s)", format="%.3f"),
+            "ROWS": st.column_config.NumberColumn("Rows", format="%d"),
+            "BYTES": st.column_config.NumberColumn("Bytes", format="%d"),
+            "QUERY_ID": st.column_config.TextColumn("Query ID")
+        }
+    )
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from anomalies import credit_series, detect_anomalies
+
+
+def daily_credits(days=60, spike_day=40, seed=0):
+    rng = np.random.default_rng(seed)
+    credits = 10 + rng.normal(0, 0.2, days)
+    credits[spike_day] = 40
+    return pd.DataFrame({
+        'DATE': pd.date_range('2025-08-01', periods=days, freq='D'),
+        'MODEL_NAME': pd.Categorical(['mistral-large'] * days),
+        'CREDITS': credits,
+    })
+
+
+def test_credit_series_fills_missing_buckets_with_zero():
+    df = daily_credits(days=5, spike_day=4).drop(index=2)
+
+    wide = credit_series({'Model': (df, 'MODEL_NAME')}, 'DAY')
+
+    assert len(wide) == 5
+    assert wide[('Model', 'mistral-large')].iloc[2] == 0.0
+
+
+def test_spike_is_flagged_once():
+    df = daily_credits()
+
+    _, flags = detect_anomalies(credit_series({'Model': (df, 'MODEL_NAME')}, 'DAY'))
+
+    assert flags['DATE'].tolist() == [df['DATE'].iloc[40]]
+    assert flags['SERIES'].tolist() == ['mistral-large']
+
+
+def test_incremental_run_matches_full_run():
+    wide = credit_series({'Model': (daily_credits(), 'MODEL_NAME')}, 'DAY')
+
+    _, full = detect_anomalies(wide)
+    state, _ = detect_anomalies(wide.iloc[:30])
+    _, incremental = detect_anomalies(wide, state)
+
+    pd.testing.assert_frame_equal(incremental, full)
+
+
+def test_window_widened_backwards_is_scored_again():
+    wide = credit_series({'Model': (daily_credits(), 'MODEL_NAME')}, 'DAY')
+
+    state, _ = detect_anomalies(wide.iloc[45:])
+    _, flags = detect_anomalies(wide, state)
+
+    assert flags['DATE'].tolist() == [wide.index[40]]
+
+
+def test_unsettled_buckets_are_not_committed_to_the_state():
+    wide = credit_series({'Model': (daily_credits(), 'MODEL_NAME')}, 'DAY')
+
+    state, _ = detect_anomalies(wide, settled_before=wide.index[50])
+
+    assert state.checkpoint == wide.index[49]
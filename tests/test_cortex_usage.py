@@ -0,0 +1,96 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from cortex_usage import compact_frame, concat_frames, filter_mask, merge_accounts, split_periods
+
+
+def functions_batch(warehouse_ids, dtype):
+    return pd.DataFrame({
+        'DATE': pd.date_range('2025-10-01', periods=len(warehouse_ids), freq='D'),
+        'MODEL_NAME': ['mistral-large'] * len(warehouse_ids),
+        'WAREHOUSE_ID': np.array(warehouse_ids, dtype=dtype),
+        'CREDITS': np.linspace(0.1, 1.0, len(warehouse_ids)),
+        'TOKENS': np.arange(len(warehouse_ids)) * 1000,
+    })
+
+
+@pytest.mark.parametrize('first, second', [
+    (functions_batch([1, 2], 'int64'), functions_batch([3.0, np.nan], 'float64')),
+    (functions_batch([1, 2], 'int8'), functions_batch([3, 300], 'int64')),
+])
+def test_concat_frames_unions_categories_of_different_dtypes(first, second):
+    df = concat_frames([compact_frame(first.copy()), compact_frame(second.copy())])
+
+    assert isinstance(df['WAREHOUSE_ID'].dtype, pd.CategoricalDtype)
+    expected = pd.concat([first['WAREHOUSE_ID'], second['WAREHOUSE_ID']], ignore_index=True).astype('Float64')
+    pd.testing.assert_series_equal(df['WAREHOUSE_ID'].astype('Float64'), expected, check_names=False)
+    assert df['CREDITS'].sum() == pytest.approx(first['CREDITS'].sum() + second['CREDITS'].sum())
+
+
+def test_concat_frames_falls_back_when_category_dtypes_still_differ():
+    first = pd.DataFrame({'WAREHOUSE_ID': pd.Series([1, 2], dtype='int8').astype('category')})
+    second = pd.DataFrame({'WAREHOUSE_ID': pd.Series([2.0, 3.5]).astype('category')})
+
+    df = concat_frames([first, second])
+
+    assert df['WAREHOUSE_ID'].tolist() == [1, 2, 2, 3.5]
+    assert len(df['WAREHOUSE_ID'].cat.categories) == 3
+
+
+def test_merge_accounts_with_different_warehouse_id_types():
+    frames = {
+        'prod_us': compact_frame(functions_batch([1, 2], 'int8')),
+        'prod_eu': compact_frame(functions_batch([70000, np.nan], 'float64')),
+        'dev': pd.DataFrame(),
+    }
+
+    df = merge_accounts(frames)
+
+    assert df['ACCOUNT'].tolist() == ['prod_us', 'prod_us', 'prod_eu', 'prod_eu']
+    assert df['WAREHOUSE_ID'].astype('Float64').tolist()[:3] == [1, 2, 70000]
+    assert df['WAREHOUSE_ID'].isna().sum() == 1
+    assert df.attrs['FRAME_ID'] == merge_accounts(frames).attrs['FRAME_ID']
+
+
+def test_filter_mask_combines_filters_and_excludes_missing_values():
+    df = compact_frame(pd.DataFrame({
+        'MODEL_NAME': ['a', 'b', 'a', None],
+        'FUNCTION_NAME': ['COMPLETE', 'COMPLETE', 'SUMMARIZE', 'COMPLETE'],
+        'WAREHOUSE_NAME': ['WH', 'WH', 'WH', 'WH'],
+        'CREDITS': [1.0, 2.0, 3.0, 4.0],
+    }))
+
+    assert filter_mask(df, models=['a']).tolist() == [True, False, True, False]
+    assert filter_mask(df, models=['a'], functions=['COMPLETE']).tolist() == [True, False, False, False]
+    assert filter_mask(df, models=[], functions=None).tolist() == [True, True, True, True]
+
+
+def test_split_periods_separates_current_and_previous_rows():
+    df = compact_frame(pd.DataFrame({
+        'DATE': pd.to_datetime(['2025-09-01', '2025-10-01', '2025-10-02']),
+        'PERIOD': ['previous', 'current', 'current'],
+        'CREDITS': [1.0, 2.0, 3.0],
+    }))
+    df.attrs['FRAME_ID'] = 'frame'
+
+    current, previous = split_periods(df)
+
+    assert current['CREDITS'].tolist() == [2.0, 3.0]
+    assert previous['CREDITS'].tolist() == [1.0]
+    assert 'PERIOD' not in current.columns
+    assert (current.attrs['FRAME_ID'], previous.attrs['FRAME_ID']) == ('frame:current', 'frame:previous')
+
+
+def test_split_periods_without_comparison_returns_an_empty_previous_frame():
+    df = compact_frame(functions_batch([1, 2], 'int64'))
+
+    current, previous = split_periods(df)
+
+    assert current is df
+    assert previous.empty and list(previous.columns) == list(df.columns)
@@ -0,0 +1,51 @@
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sql_builder import Query, bind, in_list, join, run_sql, timestamp_bind
+
+
+class RecordingSession:
+    def __init__(self):
+        self.calls = []
+
+    def sql(self, text, params=None):
+        self.calls.append((text, params))
+
+
+def test_adding_queries_keeps_text_and_binds_in_order():
+    query = "SELECT * FROM t WHERE a = " + bind("?", 1) + " AND b >= " + timestamp_bind(datetime(2025, 10, 1)) + " LIMIT 5"
+
+    assert query.text == "SELECT * FROM t WHERE a = ? AND b >= ?::TIMESTAMP_LTZ LIMIT 5"
+    assert query.params == (1, '2025-10-01 00:00:00')
+
+
+def test_bind_values_have_one_canonical_form():
+    assert bind("?", np.int64(7)).params == (7,)
+    assert type(bind("?", np.int64(7)).params[0]) is int
+    assert bind("?", pd.Timestamp('2025-10-01')) == bind("?", datetime(2025, 10, 1))
+
+
+def test_in_list_sorts_and_deduplicates_values():
+    assert in_list("MODEL_NAME", ['b', 'a', 'b']) == Query("MODEL_NAME IN (?, ?)", ['a', 'b'])
+
+
+def test_join_separates_queries_and_concatenates_binds():
+    query = join([bind("a = ?", 1), Query("b IS NULL"), bind("c = ?", 3)], " AND ")
+
+    assert query == Query("a = ? AND b IS NULL AND c = ?", [1, 3])
+
+
+def test_run_sql_only_passes_params_when_there_are_binds():
+    session = RecordingSession()
+
+    run_sql(session, bind("SELECT ?", 1))
+    run_sql(session, Query("SELECT 1"))
+    run_sql(session, "SELECT 2")
+
+    assert session.calls == [("SELECT ?", [1]), ("SELECT 1", None), ("SELECT 2", None)]
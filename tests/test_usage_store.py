@@ -0,0 +1,84 @@
+import sys
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usage_store import UsageStore
+
+VIEW = 'functions'
+
+TIMES = pd.date_range('2025-08-25', '2025-10-18', freq='90min')
+SOURCE = pd.DataFrame({'START_TIME': TIMES, 'END_TIME': TIMES + pd.Timedelta(hours=1), 'ID': range(len(TIMES))})
+
+
+def refresh(store, start_date, end_date):
+    fetched = []
+    for fetch_start, fetch_end in store.missing_ranges(VIEW, start_date, end_date):
+        rows = SOURCE[(SOURCE['START_TIME'] >= fetch_start) & (SOURCE['START_TIME'] < fetch_end)]
+        store.merge_batches(VIEW, [rows], ['ID'], fetch_start, fetch_end)
+        fetched.append((fetch_start, fetch_end))
+    return fetched
+
+
+def stored_rows(store, start_date, end_date):
+    return sum(len(df) for df in store.read_batches(VIEW, start_date, end_date))
+
+
+def source_rows(start_date, end_date):
+    return int(((SOURCE['START_TIME'] >= start_date) & (SOURCE['END_TIME'] <= end_date)).sum())
+
+
+@pytest.mark.parametrize('first, second', [
+    (('2025-10-01', '2025-10-17'), ('2025-09-01', '2025-09-10')),
+    (('2025-09-01', '2025-09-10'), ('2025-10-01', '2025-10-17')),
+])
+def test_gap_between_non_adjacent_fetches_is_fetched(tmp_path, first, second):
+    store = UsageStore(tmp_path)
+    refresh(store, *first)
+    refresh(store, *second)
+
+    fetched = refresh(store, '2025-09-01', '2025-10-17')
+
+    assert (pd.Timestamp('2025-09-10'), pd.Timestamp('2025-10-01')) in fetched
+    assert stored_rows(store, '2025-09-01', '2025-10-17') == source_rows('2025-09-01', '2025-10-17')
+
+
+def test_covered_window_only_refetches_late_arrival_overlap(tmp_path):
+    store = UsageStore(tmp_path, overlap=pd.Timedelta(hours=6))
+    refresh(store, '2025-09-01', '2025-10-17')
+
+    high_water_mark = store.read_manifest(VIEW)['high_water_mark']
+
+    assert refresh(store, '2025-09-01', '2025-10-17') == [
+        (high_water_mark - pd.Timedelta(hours=6), pd.Timestamp('2025-10-17'))
+    ]
+
+
+def test_concurrent_refreshes_keep_every_interval(tmp_path):
+    store = UsageStore(tmp_path)
+    windows = [(f'2025-09-{day:02d}', f'2025-09-{day + 2:02d}') for day in range(1, 25, 3)]
+    barrier = threading.Barrier(len(windows))
+
+    def refresh_window(start_date, end_date):
+        rows = SOURCE[(SOURCE['START_TIME'] >= start_date) & (SOURCE['START_TIME'] < end_date)]
+
+        def batches():
+            barrier.wait()
+            yield rows
+
+        store.merge_batches(VIEW, batches(), ['ID'], start_date, end_date)
+
+    threads = [threading.Thread(target=refresh_window, args=window) for window in windows]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    covered = store.read_manifest(VIEW)['intervals']
+    assert covered == [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in windows]
+    for start_date, end_date in windows:
+        assert stored_rows(store, start_date, end_date) == source_rows(start_date, end_date)
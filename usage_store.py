@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from datetime import timedelta
+
+import pandas as pd
+
+# ACCOUNT_USAGE views can lag by up to 3 hours, so rows close to the
+# high-water mark are re-fetched on every refresh and merged again.
+LATE_ARRIVAL_OVERLAP = timedelta(hours=int(os.getenv("CORTEX_COST_STORE_OVERLAP_HOURS", "6")))
+
+MANIFEST_FILE = "_manifest.json"
+
+# Streamlit sessions are threads of one process; one lock per view directory
+# serializes the read-modify-write of its partitions and manifest.
+_view_locks = {}
+_view_locks_guard = threading.Lock()
+
+
+def to_wall_time(series):
+    if getattr(series.dt, 'tz', None) is not None:
+        return series.dt.tz_localize(None)
+    return series
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class UsageStore:
+    def __init__(self, root, overlap=LATE_ARRIVAL_OVERLAP):
+        self.root = root
+        self.overlap = overlap
+
+    def _view_dir(self, view):
+        return os.path.join(self.root, view)
+
+    def _lock(self, view):
+        key = os.path.abspath(self._view_dir(view))
+        with _view_locks_guard:
+            return _view_locks.setdefault(key, threading.Lock())
+
+    def _partition_path(self, view, day):
+        return os.path.join(self._view_dir(view), f"DAY={day.isoformat()}.parquet")
+
+    def _write_atomic(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def read_manifest(self, view):
+        path = os.path.join(self._view_dir(view), MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            manifest = json.load(f)
+        if 'intervals' not in manifest:
+            # Older manifests only kept the earliest fetch and the high-water mark.
+            manifest['intervals'] = [[manifest.pop('low'), manifest['high_water_mark']]]
+        return {
+            'intervals': [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in manifest['intervals']],
+            'high_water_mark': pd.Timestamp(manifest['high_water_mark']),
+        }
+
+    def _write_manifest(self, view, manifest):
+        payload = {
+            'intervals': [[start.isoformat(), end.isoformat()] for start, end in manifest['intervals']],
+            'high_water_mark': manifest['high_water_mark'].isoformat(),
+        }
+
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump(payload, f)
+
+        self._write_atomic(os.path.join(self._view_dir(view), MANIFEST_FILE), write)
+
+    def missing_ranges(self, view, start_date, end_date):
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        manifest = self.read_manifest(view)
+        if manifest is None:
+            return [(start_date, end_date)]
+
+        # Nothing newer than the overlap before the high-water mark counts as
+        # covered, so late-arriving rows are fetched again.
+        settled = manifest['high_water_mark'] - self.overlap
+        ranges = []
+        cursor = start_date
+        for covered_start, covered_end in manifest['intervals']:
+            covered_end = min(covered_end, settled)
+            if covered_end <= max(covered_start, cursor):
+                continue
+            if covered_start > cursor:
+                ranges.append((cursor, min(covered_start, end_date)))
+            cursor = covered_end
+            if cursor >= end_date:
+                return ranges
+        ranges.append((cursor, end_date))
+        return ranges
+
+    def _write_partitions(self, view, df, key_columns):
+        df = df.copy()
+        df['START_TIME'] = to_wall_time(pd.to_datetime(df['START_TIME']))
+        df['END_TIME'] = to_wall_time(pd.to_datetime(df['END_TIME']))
+        for day, rows in df.groupby(df['START_TIME'].dt.date):
+            path = self._partition_path(view, day)
+            with self._lock(view):
+                if os.path.exists(path):
+                    rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True)
+                rows = rows.drop_duplicates(subset=key_columns, keep='last')
+                self._write_atomic(path, lambda tmp_path: rows.to_parquet(tmp_path, index=False))
+        return df['START_TIME'].max()
+
+    def merge_batches(self, view, batches, key_columns, fetch_start, fetch_end):
+        fetch_start, fetch_end = pd.Timestamp(fetch_start), pd.Timestamp(fetch_end)
+        high_water_mark = fetch_start
+
+        # The manifest only moves once every batch is on disk, so an
+        # interrupted fetch is retried in full on the next refresh.
+        for df in batches:
+            if not df.empty:
+                high_water_mark = max(high_water_mark, self._write_partitions(view, df, key_columns))
+
+        # Re-read under the lock so intervals recorded by a concurrent refresh are kept.
+        with self._lock(view):
+            manifest = self.read_manifest(view) or {'intervals': [], 'high_water_mark': high_water_mark}
+            manifest['high_water_mark'] = max(manifest['high_water_mark'], high_water_mark)
+            manifest['intervals'] = merge_intervals(manifest['intervals'] + [(fetch_start, fetch_end)])
+            self._write_manifest(view, manifest)
+
+    def read_batches(self, view, start_date, end_date):
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        for day in pd.date_range(start_date.normalize(), end_date.normalize(), freq='D'):
+            path = self._partition_path(view, day.date())
+            if os.path.exists(path):
+                df = pd.read_parquet(path)
+                yield df[(df['START_TIME'] >= start_date) & (df['END_TIME'] <= end_date)]